@@ -6,15 +6,18 @@
 
 import os
 import glob
+import pickle
+import random
+import argparse
 import pathlib
 from datetime import datetime
+from multiprocessing import Pool
 
 from queue import Empty
 from typing import Dict
 import frontmatter
 import csv
 import gspread as gs
-import gspread_formatting as gsf
 
 branches = [ "develop", "main", "production" ]
 
@@ -57,6 +60,15 @@ contributor_fields = ["role", "name", "headshot", "caption", "bio"]
 
 header_image_fields = ["filename", "alt_text"]
 
+# The harvest cache, the `filtered` row and warnings of every article, keyed by its path, is reused for any 
+# article whose modification time and size are unchanged.  Bump CACHE_VERSION whenever the harvest itself 
+# changes, so every article is harvested again.
+cache_filename = "front-matter-cache.pickle"
+CACHE_VERSION = 1
+
+# Fewer changed articles than this, or a single CPU, and they are parsed right here rather than in a process pool
+POOL_MINIMUM = 50
+
 
 def truncate(text):
   if type(text) is str:
@@ -96,76 +108,189 @@ def parent_path(path):
   else:
     return f"{parent}"
 
-# Lifted from https://stackoverflow.com/a/54231563
-#  csv_file - path to csv file to upload
-#  sheet - a gspread.Spreadsheet object
-#  cell - string giving starting cell, optionally including sheet/tab name
-#    example: 'A1', 'MySheet!C3', etc.
-def paste_csv(csv_file, sheet, cell):
-  if '!' in cell:
-    (tab_name, cell) = cell.split('!')
-    wks = sheet.worksheet(tab_name)
-  else:
-    wks = sheet.sheet1
-  (first_row, first_column) = gs.utils.a1_to_rowcol(cell)
+# Sort rows by Content Path, then by articleIndex, the way the Google Sheet itself would sort them: numbers
+# first in numeric order, then any other text, then blanks
+def sort_key(row):
+  index = row.get(fields['articleIndex'], "")
+  try:
+    return (row[fields['md-path']], 0, float(index), "")
+  except (TypeError, ValueError):
+    return (row[fields['md-path']], 1 if index != "" else 2, 0, str(index))
+
+# Publish the .csv, with `rows` rows counting its header, to a new tab in ONE batch_update request.  The tab is 
+# added with its header row frozen, the .csv is pasted in, the header is made bold, and any to-do's are 
+# highlighted.  The rows are already sorted locally, see sort_key().  Formatting after
+# https://pypi.org/project/gspread-formatting/ and the paste after https://stackoverflow.com/a/54231563
+def publish_csv(csv_file, sheet, tab_name, rows):
+  sheet_id = random.randint(1, 2**31 - 1)   # chosen here, so the other requests can name the new tab
+  rows = max(rows, 2)
+  columns = len(fields)
+  todo = list(fields.keys()).index('to-do')
 
   with open(csv_file, 'r') as f:
     csv_contents = f.read()
   body = {
     'requests': [{
+      'addSheet': {
+        'properties': {
+          'sheetId': sheet_id,
+          'title': tab_name,
+          'gridProperties': { 'rowCount': rows, 'columnCount': columns, 'frozenRowCount': 1 },
+        }
+      }
+    }, {
       'pasteData': {
-        "coordinate": {
-          "sheetId": wks.id,
-          "rowIndex": first_row-1,
-          "columnIndex": first_column-1,
-        },
+        "coordinate": { "sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0 },
         "data": csv_contents,
         "type": 'PASTE_NORMAL',
         "delimiter": ',',
       }
+    }, {
+      'repeatCell': {
+        'range': { 'sheetId': sheet_id, 'startRowIndex': 0, 'endRowIndex': 1 },
+        'cell': {
+          'userEnteredFormat': {
+            'backgroundColor': { 'red': 0.9, 'green': 0.9, 'blue': 0.9 },
+            'textFormat': { 'bold': True, 'foregroundColor': { 'red': 0, 'green': 0, 'blue': 0 } },
+          }
+        },
+        'fields': 'userEnteredFormat(backgroundColor,textFormat(bold,foregroundColor))',
+      }
+    }, {
+      'addConditionalFormatRule': {
+        'rule': {
+          'ranges': [{ 'sheetId': sheet_id, 'startRowIndex': 1, 'endRowIndex': rows, 'startColumnIndex': todo, 'endColumnIndex': todo + 1 }],
+          'booleanRule': {
+            'condition': { 'type': 'NOT_BLANK' },
+            'format': { 'textFormat': { 'bold': True }, 'backgroundColor': { 'red': 1, 'green': 1, 'blue': 0 } },
+          }
+        },
+        'index': 0,
+      }
     }]
   }
   return sheet.batch_update(body)
+
+# Read one article's front matter into its `filtered` .csv row, and return it with the warnings it raised
+def harvest_article(file):
+  path = pathlib.PurePath(file)
+  article = frontmatter.load(file)
+  obsolete = []
+  warnings = []
+  filtered = dict()  # must be sure to initialize this to empty here!
+
+  # Loop on each top-level element of the article's front matter 
+  for key in article.metadata:
+
+    # Found a key that we didn't expect... warning
+    if key not in fields.keys():
+      assert key not in obsolete, "Error: Front matter key '{key}' does not exist in ANY list!"
+
+      warnings.append(f"Warning: Front matter key '{key}' is obselete. This article needs to be updated!")
+      obsolete.append(key)
     
-# From an example at https://pypi.org/project/gspread-formatting/
-def format_google_sheet(sheet, tab_name):
-  bold = gsf.cellFormat(
-    backgroundColor=gsf.color(0.9, 0.9, 0.9),
-    textFormat=gsf.textFormat(bold=True, foregroundColor=gsf.color(0, 0, 0)),
-    )
-  wks = sheet.worksheet(tab_name)
-  batch = gsf.batch_updater(sheet)
-  batch.set_frozen(wks, rows=1)
-  batch.format_cell_ranges(wks, [('A1:Z1', bold)])
-  return batch.execute()
-
-# From a blog post at https://stackoverflow.com/questions/50938274/sort-a-spread-sheet-via-gspread
-def sort_google_sheet(sheet, tab_name):
-  wks = sheet.worksheet(tab_name)
-  wks.sort((9, 'asc'))   # sort first by articleIndex
-  wks.sort((1, 'asc'))   # now sort by Content Path
-  return
-
-# From an example at https://pypi.org/project/gspread-formatting/
-def highlight_todo_cells(sheet, tab_name):
-  wks = sheet.worksheet(tab_name)
-  rule = gsf.ConditionalFormatRule(
-    ranges=[gsf.GridRange.from_a1_range('H2:H2000', wks)],
-    booleanRule=gsf.BooleanRule(
-        condition=gsf.BooleanCondition('NOT_BLANK'),
-        format=gsf.cellFormat(textFormat=gsf.textFormat(bold=True), backgroundColor=gsf.Color(1,1,0))
-    )
-  )
-
-  rules = gsf.get_conditional_format_rules(wks)
-  rules.append(rule)
-  rules.save()
+    # We have an expected top-level key and value
+    else:
+      value = article.metadata[key]
+
+      # If we have a list...
+      if type(value) is list:
+        if key == "contributors":
+          c = value[0]
+          for f in contributor_fields:
+            if f in c.keys():
+              filtered[fields[f]] = truncate(c[f])
+            else:
+              filtered[fields[f]] = ""
+          value = len(value)
+
+        # Just a list, nothing special  
+        else:  
+          value = ",".join(value)
+
+      # If we have a dict...
+      if type(value) is dict:
+        if key == "header_image":
+          for f in header_image_fields:
+            if f in value.keys():
+              filtered[fields[f]] = truncate(value[f])
+            else:
+              filtered[fields[f]] = ""
+          value = True
+        else:
+          warnings.append(f"Warning: Unexpected front matter dict {key} found!")
+
+      filtered[fields[key]] = truncate(value)
+
+  # Seed the .csv row with path and filename
+  filtered[fields['md-file']] = path.name[:-3]
+  filtered[fields['md-path']] = parent_path(path)
+
+  # Build one live link for each code branch and seed the .csv row with them
+  for key in branches:
+    key_name = f"{key}-link"
+    filtered[fields[key_name]] = build_link(key, path)
+
+  # Note any obsolete front matter
+  filtered[fields['obsolete']] = obsolete
+
+  return filtered, warnings
+
+# Harvest every file, in order, reusing the cached row of any article unchanged since the last run, and 
+# parsing the rest in a process pool.  Returns the rows, and saves the refreshed cache.
+def harvest(files, cache_file):
+  cache = dict()
+  try:
+    with open(cache_file, 'rb') as f:
+      saved = pickle.load(f)
+    if saved.get("version") == CACHE_VERSION:
+      cache = saved["articles"]
+  except FileNotFoundError:
+    pass
+  except Exception as e:
+    print(f"Ignoring the harvest cache '{cache_file}': {e}")
+
+  keys = dict()
+  stale = []
+  for file in files:
+    stat = os.stat(file)
+    keys[file] = (stat.st_mtime_ns, stat.st_size)
+    cached = cache.get(file)
+    if cached is None or cached[0] != keys[file]:
+      stale.append(file)
+
+  if len(stale) < POOL_MINIMUM or (os.cpu_count() or 1) < 2:
+    harvested = map(harvest_article, stale)
+  else:
+    with Pool() as pool:
+      harvested = pool.map(harvest_article, stale, chunksize=max(1, len(stale) // (4 * (os.cpu_count() or 1))))
+  for file, (filtered, warnings) in zip(stale, harvested):
+    cache[file] = (keys[file], filtered, warnings)
+
+  # Keep just the articles that are still here
+  cache = { file: cache[file] for file in files }
+  with open(cache_file + ".tmp", 'wb') as f:
+    pickle.dump({ "version": CACHE_VERSION, "articles": cache }, f)
+  os.replace(cache_file + ".tmp", cache_file)
+
+  print(f"Harvested {len(files)} articles, {len(stale)} parsed and {len(files) - len(stale)} unchanged")
+  rows = []
+  for file in files:
+    key, filtered, warnings = cache[file]
+    for warning in warnings:
+      print(warning)
+    rows.append(filtered)
+  return rows
 
 
 ######################################################################
 
 # Main...
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Harvest the front matter of every Rootstalk article into a .csv, and a new tab of our Google Sheet.")
+  parser.add_argument('--sheets-standin', metavar='STATE', help="use the offline Google Sheets stand-in, with the spreadsheets in this JSON state file, see sheets_standin.py")
+  args = parser.parse_args()
+
   csv_filename = "front-matter-status.csv"
   
   # Open the .csv file for output
@@ -177,75 +302,19 @@ if __name__ == '__main__':
     filepath = str(pathlib.Path.home()) + "/GitHub/rootstalk/content/**/volume*/*.md"
   
     # Iterate over the working directory tree + subdirectories for all {issue}/{article}.md files
-    # Using '*.md' pattern recursively
-    for file in glob.glob(filepath, recursive=True):
-    
-      path = pathlib.PurePath(file)
-      article = frontmatter.load(file)
-      obsolete = []
-      filtered = dict()  # must be sure to initialize this to empty here!
-
-      # Loop on each top-level element of the article's front matter 
-      for key in article.metadata:
-
-        # Found a key that we didn't expect... warning
-        if key not in fields.keys():
-          assert key not in obsolete, "Error: Front matter key '{key}' does not exist in ANY list!"
-
-          print(f"Warning: Front matter key '{key}' is obselete. This article needs to be updated!")
-          obsolete.append(key)
-        
-        # We have an expected top-level key and value
-        else:
-          value = article.metadata[key]
-
-          # If we have a list...
-          if type(value) is list:
-            if key == "contributors":
-              c = value[0]
-              for f in contributor_fields:
-                if f in c.keys():
-                  filtered[fields[f]] = truncate(c[f])
-                else:
-                  filtered[fields[f]] = ""
-              value = len(value)
-
-            # Just a list, nothing special  
-            else:  
-              value = ",".join(value)
-
-          # If we have a dict...
-          if type(value) is dict:
-            if key == "header_image":
-              for f in header_image_fields:
-                if f in value.keys():
-                  filtered[fields[f]] = truncate(value[f])
-                else:
-                  filtered[fields[f]] = ""
-              value = True
-            else:
-              print(f"Warning: Unexpected front matter dict {key} found!")
-
-          filtered[fields[key]] = truncate(value)
-    
-      # Seed the .csv row with path and filename
-      filtered[fields['md-file']] = path.name[:-3]
-      filtered[fields['md-path']] = parent_path(path)
-
-      # Build one live link for each code branch and seed the .csv row with them
-      for key in branches:
-        key_name = f"{key}-link"
-        filtered[fields[key_name]] = build_link(key, path)
-
-      # Note any obsolete front matter
-      filtered[fields['obsolete']] = obsolete
-
+    # Using '*.md' pattern recursively, harvest their front matter, and sort it by Content Path and articleIndex
+    rows = sorted(harvest(glob.glob(filepath, recursive=True), cache_filename), key=sort_key)
+    for filtered in rows:
       writer.writerow(filtered)
 
   # Ok, done writing the .csv, now copy it to a new tab/worksheet in our Google Sheet
   # Open the Google service account and sheet
   try:
-    sa = gs.service_account()
+    if args.sheets_standin:
+      import sheets_standin
+      sa = sheets_standin.service_account(state=args.sheets_standin)
+    else:
+      sa = gs.service_account()
   except Exception as e:
     print(e)
 
@@ -257,32 +326,8 @@ if __name__ == '__main__':
   # Make a datestamp to name the new worksheet
   sheet_name = datetime.now().strftime("%Y-%b-%d-%I:%M%p")
   
-  # Create the new/empty worksheet
-  try:
-    worksheet = sh.add_worksheet(title=sheet_name, rows=1, cols=1)
-  except Exception as e:
-    print(e)  
-
-  # Call our function to write the new Google Sheet worksheet
-  try:
-    paste_csv(csv_filename, sh, sheet_name + "!A1")
-  except Exception as e:
-    print(e)
-
-  # Call our format function to set the overall format of the new sheet
-  try:
-    format_google_sheet(sh, sheet_name)
-  except Exception as e:
-    print(e)
-
-  # Call our function to sort the new sheet
-  try:
-    sort_google_sheet(sh, sheet_name)
-  except Exception as e:
-    print(e)
-
-  # Call our function to set conditional formatting rules
+  # Create, fill, and format the new worksheet all in one request
   try:
-    highlight_todo_cells(sh, sheet_name)
+    publish_csv(csv_filename, sh, sheet_name, len(rows) + 1)
   except Exception as e:
     print(e)
@@ -0,0 +1,410 @@
+# benchmark-transform.py
+##
+## A benchmark harness for transform-mods-csv-to-ready-for-CB.py.  It generates a realistic, synthetic `mods.csv`
+## export, using every column in the script's `transform` mapping, at one or more sizes (10k, 100k and 1M rows by
+## default), then times the read, transform, validation and write stages on their own, the write stage again for
+## each of the other output formats, each transform function on its own, and a complete local-mode run end-to-end.
+## With --links it also times --check-links against a local stub HTTP server, and with --sheets a complete run
+## through the offline Google Sheets stand-in, from reading the spreadsheet to pasting the new tab.  The startup time of the script,
+## everything a run pays before its first record, is measured once.  Every measurement runs in a fresh process so that its
+## peak RSS is its own.  Results are printed as rows/sec and saved as JSON so that runs of different versions
+## can be compared with --baseline.
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import threading
+import http.server
+import resource
+import platform
+import subprocess
+import multiprocessing
+import importlib.util
+from datetime import datetime
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transform-mods-csv-to-ready-for-CB.py")
+sys.path.insert(0, os.path.dirname(script))
+import sheets_standin
+import transform_mods_cli.core as tm
+
+# The CollectionBuilder-CSV demo `Sheet1` headings
+cb_headings = [
+  "objectid", "parentid", "title", "creator", "date", "description", "subject", "location", "latitude",
+  "longitude", "source", "identifier", "type", "format", "language", "rights", "rightsstatement",
+  "display_template", "object_location", "image_small", "image_thumb", "image_alt_text", "object_transcript"
+]
+
+words = ("grinnell college iowa prairie campus students faculty library archives photograph letter river town "
+  "farm railroad church music theatre athletics science history war peace harvest winter spring summer autumn "
+  "portrait building street parade alumni commencement lecture report newspaper map survey family").split( )
+
+surnames = ["Smith", "Johnson", "Grinnell", "Herrick", "Magoun", "Noyce", "Harris", "Lee", "Ward", "Steiner"]
+given = ["Mary", "John", "Josiah", "Ruth", "Robert", "Anna", "George", "Helen", "Samuel", "Grace"]
+roles = ["Author", "Photographer", "Creator", "Editor", "Interviewee", "Interviewer", "Contributor"]
+
+resource_types = [
+  "still image~http://id.loc.gov/vocabulary/resourceTypes/img",
+  "text~http://id.loc.gov/vocabulary/resourceTypes/txt",
+  "sound recording~http://id.loc.gov/vocabulary/resourceTypes/aud",
+  "moving image~http://id.loc.gov/vocabulary/resourceTypes/mov",
+]
+
+# How often each CModel turns up in a typical Digital Grinnell collection
+cmodel_weights = {
+  "islandora:sp_basic_image": 30, "islandora:sp_large_image_cmodel": 20, "islandora:sp_pdf": 15,
+  "islandora:compoundCModel": 4, "islandora:bookCModel": 1, "islandora:pageCModel": 20,
+  "islandora:sp-audioCModel": 3, "islandora:oralhistoriesCModel": 2, "islandora:sp_videoCModel": 2,
+  "islandora:binaryObjectCModel": 2, "islandora:sp_web_archive": 1
+}
+
+def phrase( rng, low, high ):
+  return " ".join(rng.choice(words) for _ in range(rng.randint(low, high)))
+
+# benchmark_columns: every column of `transform` the script can actually run.  Columns mapped to a function
+#   that does not exist (e.g. "TRANSCRIPT") would fail the plan, so they are left out and reported.
+def benchmark_columns( ):
+  columns, skipped = [], []
+  for column, t in tm.transform.items():
+    if isinstance(t, dict) and not callable(getattr(tm, next(iter(t)), None)):
+      skipped.append(column)
+    else:
+      columns.append(column)
+  return columns, skipped
+
+# benchmark_headings: the CB demo headings plus any other target the mapping needs
+def benchmark_headings( columns ):
+  headings = list(cb_headings)
+  for column in columns:
+    t = tm.transform[column]
+    to = next(iter(t.values())) if isinstance(t, dict) else t
+    if to is not None and to not in headings:
+      headings.append(to)
+  return headings
+
+# synthetic_value: one realistic value for one MODS column of record n
+def synthetic_value( rng, column, n, cmodel, parent ):
+  if column == "PID":
+    return "grinnell:{}".format(n)
+  if column == "PARENT":
+    return parent
+  if column == "CMODEL":
+    return cmodel
+  if column == "SEQUENCE":
+    return str(n % 50) if cmodel == "islandora:pageCModel" else ""
+  if column == "OBJ":
+    return "https://digital.grinnell.edu/islandora/object/grinnell:{}".format(n)
+  if column == "THUMBNAIL":
+    return ""
+  if column == "Title":
+    return phrase(rng, 2, 10).title( )
+  if column == "Personal_Names~Roles":
+    return " | ".join("{}, {}~{}".format(rng.choice(surnames), rng.choice(given), rng.choice(roles)) for _ in range(rng.randint(1, 5)))
+  if column == "Abstract":
+    return phrase(rng, 50, 300).capitalize( ) + "."
+  if column in ("Index_Date", "Date_Issued", "Date_Captured"):
+    return "{}-{:02d}-{:02d}".format(rng.randint(1860, 2020), rng.randint(1, 12), rng.randint(1, 28))
+  if column == "Keywords":
+    return "|".join(phrase(rng, 1, 2) for _ in range(rng.randint(1, 8)))
+  if column == "Subjects_Geographic":
+    return rng.choice(["Grinnell (Iowa)", "Grinnell (Iowa)|Iowa", "Poweshiek County (Iowa)|Iowa|United States", ""])
+  if column == "Type_of_Resource~AuthorityURI":
+    return rng.choice(resource_types)
+  if column == "Language_Names~Codes":
+    return rng.choice(["English~eng", "English~eng", "Spanish~spa"])
+  if column == "MIME_Type":
+    return rng.choice(["image/jpeg", "image/tiff", "application/pdf", "audio/mpeg", "video/mp4"])
+  if column == "Access_Condition":
+    return "http://rightsstatements.org/vocab/InC-EDU/1.0/"
+  if column == "Local_Identifier":
+    return "grinnell_{}".format(n)
+  if column in ("WORKSPACE", "Import_Source", "Primary_Sort", "Import_Index"):
+    return ""
+  return phrase(rng, 0, 6)
+
+# generate_mods_csv: write a synthetic `mods.csv` export of `rows` records.  Compound and book objects are
+#   followed by their children, just like an Islandora export.
+def generate_mods_csv( mods_csv, rows, seed=1 ):
+  rng = random.Random(seed)
+  columns, skipped = benchmark_columns( )
+  cmodels, weights = list(cmodel_weights), list(cmodel_weights.values())
+  with open(mods_csv, 'w', newline='') as csvfile:
+    writer = csv.writer(csvfile)
+    writer.writerow(columns)
+    parent, children = "grinnell:collection", 0
+    for n in range(rows):
+      if children > 0:
+        cmodel, children = "islandora:pageCModel", children - 1
+        record_parent = parent
+      else:
+        cmodel = rng.choices(cmodels, weights)[0]
+        record_parent = "grinnell:collection"
+        if cmodel in ("islandora:compoundCModel", "islandora:bookCModel"):
+          parent, children = "grinnell:{}".format(n), rng.randint(2, 40)
+      writer.writerow([synthetic_value(rng, column, n, cmodel, record_parent) for column in columns])
+  return columns, skipped
+
+## Measurements...
+# Each measure_* function runs in a fresh process, via isolated(), and returns its own seconds and peak RSS.
+
+# peak_rss: this process's peak resident set size, in bytes
+def peak_rss( ):
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss if sys.platform == "darwin" else rss * 1024
+
+# timed: pass items through, adding the time spent producing them to clock[0]
+def timed( items, clock ):
+  items = iter(items)
+  while True:
+    start = time.perf_counter( )
+    try:
+      item = next(items)
+    except StopIteration:
+      clock[0] += time.perf_counter( ) - start
+      return
+    clock[0] += time.perf_counter( ) - start
+    yield item
+
+def inputs( mods_csv, headings_csv ):
+  old_headings = tm.local_headings(mods_csv)
+  new_headings = tm.local_headings(headings_csv)
+  return old_headings, new_headings, tm.build_transform_plan(old_headings, new_headings)
+
+def measure_read( mods_csv, headings_csv, output ):
+  start = time.perf_counter( )
+  for record in tm.local_mods_records(mods_csv):
+    pass
+  return time.perf_counter( ) - start, peak_rss( )
+
+def measure_transform( mods_csv, headings_csv, output ):
+  old_headings, new_headings, plan = inputs(mods_csv, headings_csv)
+  reading = [0.0]
+  start = time.perf_counter( )
+  for row in tm.transformed_rows(timed(tm.local_mods_records(mods_csv), reading), plan, old_headings, new_headings):
+    pass
+  return time.perf_counter( ) - start - reading[0], peak_rss( )
+
+def measure_validation( mods_csv, headings_csv, output ):
+  start = time.perf_counter( )
+  old_headings, new_headings, plan = inputs(mods_csv, headings_csv)
+  checks = time.perf_counter( ) - start
+  producing = [0.0]
+  rows = tm.transformed_rows(tm.local_mods_records(mods_csv), plan, old_headings, new_headings)
+  validation = tm.new_validation(new_headings)
+  start = time.perf_counter( )
+  for row in tm.validated_rows(timed(rows, producing), new_headings, validation):
+    pass
+  tm.finish_validation(validation, plan)
+  return checks + time.perf_counter( ) - start - producing[0], peak_rss( )
+
+def measure_write( mods_csv, headings_csv, output ):
+  old_headings, new_headings, plan = inputs(mods_csv, headings_csv)
+  producing = [0.0]
+  rows = tm.transformed_rows(tm.local_mods_records(mods_csv), plan, old_headings, new_headings)
+  start = time.perf_counter( )
+  tm.write_transformed(timed(rows, producing), new_headings, output)
+  return time.perf_counter( ) - start - producing[0], peak_rss( )
+
+# measure_function: time just one step of the plan, `step` is its index, over every record
+def measure_function( mods_csv, headings_csv, output, step ):
+  old_headings, new_headings, plan = inputs(mods_csv, headings_csv)
+  index, column, func, to, target = plan[step]
+  layout = tm.row_layout(old_headings, new_headings)
+  seconds = 0.0
+  for chunk in tm.chunked(tm.local_mods_records(mods_csv), 10000):
+    contexts = [tm.RecordContext(record, layout, [None] * layout[2]) for record in chunk]
+    start = time.perf_counter( )
+    for record, ctx in zip(chunk, contexts):
+      func(record[index], column, to, ctx)
+    seconds += time.perf_counter( ) - start
+  return seconds, peak_rss( )
+
+# isolated: run one measure_* function in a fresh process so its peak RSS is its own
+def isolated( measure, *args ):
+  with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+    return pool.apply(measure, args)
+
+# measure_links: time checking every link in the output, none of them cached, against the stub server at `base`
+def measure_links( output, base ):
+  counts = {}
+  start = time.perf_counter( )
+  tm.check_output_links(output, ":memory:", 0, 32, counts, base=base)
+  return time.perf_counter( ) - start, peak_rss( )
+
+# StubHandler: answers every HEAD request with 200, keeping the connection alive, like the repository's server
+class StubHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def do_HEAD( self ):
+    self.send_response(200)
+    self.send_header("Content-Length", "0")
+    self.end_headers( )
+
+  def log_message( self, format, *args ):
+    pass
+
+# stub_server: start a local stub HTTP server in a background thread, returns its base URL
+def stub_server( ):
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, daemon=True).start( )
+  return "http://127.0.0.1:{}".format(server.server_address[1])
+
+# measure_startup: the median wall time of `--help`, the imports and argument parsing every run starts with
+def measure_startup( runs=5 ):
+  times = []
+  for n in range(runs):
+    start = time.perf_counter( )
+    subprocess.run([sys.executable, script, "--help"], check=True, stdout=subprocess.DEVNULL)
+    times.append(time.perf_counter( ) - start)
+  return sorted(times)[runs // 2]
+
+# measure_end_to_end: time a complete local-mode run of the script.  Run isolated(), the only child whose 
+#   peak RSS is reported is the script itself.
+def measure_end_to_end( mods_csv, headings_csv, workdir, workers ):
+  start = time.perf_counter( )
+  subprocess.run([sys.executable, script, "--mods-csv", mods_csv, "--headings", headings_csv, "--workers", str(workers)],
+    cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+  seconds = time.perf_counter( ) - start
+  rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return seconds, rss if sys.platform == "darwin" else rss * 1024
+
+# measure_sheets: time a complete run of the script through the offline Sheets stand-in, reading `mods.csv` and
+#   `Sheet1` from a spreadsheet and pasting the output into a new tab, with `latency` seconds added to every 
+#   request.  Returns the number of requests too.
+def measure_sheets( mods_csv, headings_csv, workdir, workers, latency ):
+  state = os.path.join(workdir, "sheets-standin.json")
+  client = sheets_standin.Client(state)
+  client.state["settings"]["latency"] = latency
+  sheets_standin.load_spreadsheet(client, "benchmark", [("mods.csv", mods_csv), ("Sheet1", headings_csv)])
+  client.save( )
+
+  start = time.perf_counter( )
+  subprocess.run([sys.executable, script, "--sheet", "benchmark", "--sheets-standin", state, "--workers", str(workers), "--output", "transformed-sheets.csv"],
+    cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+  seconds = time.perf_counter( ) - start
+  rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  with open(state) as f:
+    requests = json.load(f)["stats"]["requests"]
+  os.remove(state)
+  os.remove(os.path.join(workdir, "transformed-sheets.csv"))
+  return seconds, rss if sys.platform == "darwin" else rss * 1024, requests
+
+def result( rows, seconds, rss ):
+  return { "seconds": round(seconds, 4), "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None, "peak_rss_mb": round(rss / 2**20, 1) }
+
+# run_benchmark: generate one synthetic export and measure everything for it
+def run_benchmark( rows, workdir, workers, functions, stub=None, sheets_latency=None ):
+  mods_csv = os.path.join(workdir, "mods-{}.csv".format(rows))
+  headings_csv = os.path.join(workdir, "Sheet1.csv")
+  output = os.path.join(workdir, "transformed-{}.csv".format(rows))
+
+  start = time.perf_counter( )
+  columns, skipped = generate_mods_csv(mods_csv, rows)
+  generated = time.perf_counter( ) - start
+  with open(headings_csv, 'w', newline='') as csvfile:
+    csv.writer(csvfile).writerow(benchmark_headings(columns))
+  print("Generated {} rows ({:.0f} MB) in {:.1f}s{}".format(rows, os.path.getsize(mods_csv) / 2**20, generated,
+    ", skipping unrunnable columns {}".format(skipped) if skipped else ""))
+
+  report = { "rows": rows, "mods_csv_bytes": os.path.getsize(mods_csv), "skipped_columns": skipped, "stages": {}, "functions": {} }
+  for stage, measure in (("read", measure_read), ("transform", measure_transform), ("validation", measure_validation), ("write", measure_write)):
+    report["stages"][stage] = result(rows, *isolated(measure, mods_csv, headings_csv, output))
+  report["stages"]["write"]["bytes"] = os.path.getsize(output)
+
+  # The same write in each of the other output formats, with the size of the file it makes
+  for extension in (".csv.gz", ".ndjson", ".parquet"):
+    if extension == ".parquet" and importlib.util.find_spec("pyarrow") is None:
+      continue
+    formatted = os.path.join(workdir, "transformed-{}{}".format(rows, extension))
+    report["stages"]["write " + extension[1:]] = dict(result(rows, *isolated(measure_write, mods_csv, headings_csv, formatted)), bytes=os.path.getsize(formatted))
+    os.remove(formatted)
+  if stub:
+    report["stages"]["check links"] = result(rows, *isolated(measure_links, output, stub))
+  report["stages"]["end_to_end"] = result(rows, *isolated(measure_end_to_end, mods_csv, headings_csv, workdir, workers))
+  if sheets_latency is not None:
+    seconds, rss, requests = isolated(measure_sheets, mods_csv, headings_csv, workdir, workers, sheets_latency)
+    report["stages"]["end_to_end sheets"] = dict(result(rows, seconds, rss), requests=requests)
+
+  if functions:
+    old_headings, new_headings, plan = inputs(mods_csv, headings_csv)
+    for step, (index, column, func, to, target) in enumerate(plan):
+      if func is not None:
+        key = "{}({})".format(func.__name__, column)
+        report["functions"][key] = result(rows, *isolated(measure_function, mods_csv, headings_csv, output, step))
+
+  os.remove(mods_csv)
+  os.remove(output)
+  os.remove(os.path.join(workdir, "transformed.csv"))
+  return report
+
+# print_report: one table per size, with the change in rows/sec against a baseline run, if there is one
+def print_report( report, baseline ):
+  before = { r["rows"]: r for r in (baseline or {}).get("results", []) }
+  change = ""
+  if (baseline or {}).get("startup_seconds"):
+    change = " ({:+.1f}%)".format(100.0 * (report["startup_seconds"] / baseline["startup_seconds"] - 1))
+  print("\nStartup: {:.3f}s{}".format(report["startup_seconds"], change))
+  for r in report["results"]:
+    print("\n{:,} rows".format(r["rows"]))
+    print("  {:<52} {:>10} {:>12} {:>10} {:>8}".format("measurement", "seconds", "rows/sec", "peak MB", "change"))
+    for group in ("stages", "functions"):
+      for name, m in r[group].items():
+        change = ""
+        old = before.get(r["rows"], {}).get(group, {}).get(name)
+        if old and old.get("rows_per_sec") and m["rows_per_sec"]:
+          change = "{:+.1f}%".format(100.0 * (m["rows_per_sec"] / old["rows_per_sec"] - 1))
+        print("  {:<52} {:>10.3f} {:>12,.0f} {:>10.1f} {:>8}".format(name, m["seconds"], m["rows_per_sec"] or 0, m["peak_rss_mb"], change))
+
+def git_version( ):
+  try:
+    return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(script), capture_output=True, text=True).stdout.strip( )
+  except Exception:
+    return None
+
+######################################################################
+
+# Main...
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description="Benchmark transform-mods-csv-to-ready-for-CB.py against synthetic MODS exports.")
+  parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help="export sizes to benchmark (default 10000 100000 1000000)")
+  parser.add_argument('--workdir', default="benchmark-data", help="where the synthetic exports are written (default ./benchmark-data)")
+  parser.add_argument('--workers', type=int, default=1, help="--workers for the end-to-end run (default 1)")
+  parser.add_argument('--links', action='store_true', help="also time --check-links, against a local stub HTTP server")
+  parser.add_argument('--sheets', action='store_true', help="also time a complete run through the offline Google Sheets stand-in")
+  parser.add_argument('--sheets-latency', type=float, default=0.1, metavar='SECONDS', help="with --sheets, the latency of every request (default 0.1)")
+  parser.add_argument('--no-functions', action='store_true', help="skip timing each transform function on its own")
+  parser.add_argument('--output', default="benchmark-results.json", help="where to save the results (default benchmark-results.json)")
+  parser.add_argument('--baseline', help="an earlier results .json to compare against")
+  args = parser.parse_args()
+
+  os.makedirs(args.workdir, exist_ok=True)
+  workdir = os.path.abspath(args.workdir)
+
+  stub = stub_server( ) if args.links else None
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+  report = {
+    "version": git_version( ),
+    "date": datetime.now().isoformat(timespec='seconds'),
+    "python": platform.python_version( ),
+    "platform": platform.platform( ),
+    "cpus": os.cpu_count( ),
+    "workers": args.workers,
+    "startup_seconds": round(measure_startup( ), 4),
+    "results": [run_benchmark(rows, workdir, args.workers, not args.no_functions, stub, args.sheets_latency if args.sheets else None) for rows in args.rows],
+  }
+
+  with open(args.output, 'w') as f:
+    json.dump(report, f, indent=2)
+
+  print_report(report, baseline)
+  print("\nSaved results to '{}'".format(args.output))
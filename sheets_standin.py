@@ -0,0 +1,483 @@
+# sheets_standin.py
+##
+## An offline stand-in for the parts of gspread, and the Google Sheets API behind it, that
+## transform-mods-csv-to-ready-for-CB.py and .rootstalk-front-matter-to-google-sheet.py use.  Spreadsheets live
+## in a local JSON state file instead of Google Drive, so a complete read -> transform -> add_worksheet ->
+## paste_csv run can be tested, and timed, on a box with no network and no credentials.  Like the real thing,
+## every request can be slowed by a fixed latency, refused when its payload is too large, and refused with a
+## 429 "quota exceeded" error, either at random or past a number of requests per minute.
+##
+## Both scripts use it in place of Google Sheets with --sheets-standin STATE.json.  Make a state file from local
+## .csv exports, and set how it behaves, with:
+##
+##   python3 sheets_standin.py STATE.json --spreadsheet CB-CSV_DG-01 --tab mods.csv=mods.csv --tab Sheet1=Sheet1.csv
+##
+## Any changes a run makes are saved back to the state file when it exits, and running this with just the state
+## file lists its spreadsheets, tabs and request counts.
+
+import os
+import io
+import re
+import csv
+import sys
+import json
+import time
+import atexit
+import random
+import argparse
+import threading
+import itertools
+from collections import deque
+
+DEFAULT_SETTINGS = {
+  "latency": 0.0,              # seconds added to every request
+  "max_payload": 10 * 2**20,   # the largest request body, in bytes, accepted
+  "error_rate": 0.0,           # the chance of any request being refused with a 429
+  "per_minute": 0,             # requests accepted in any minute before the rest are refused with a 429, 0 for no limit
+  "seed": None,                # seed for the random 429s, so a run can be repeated exactly
+}
+
+# Exceptions, with the names gspread gives them
+class GSpreadException(Exception):
+  pass
+
+class SpreadsheetNotFound(GSpreadException):
+  pass
+
+class WorksheetNotFound(GSpreadException):
+  pass
+
+# Response: just enough of a requests.Response for code that looks at `e.response.status_code`
+class Response:
+
+  def __init__( self, status_code, error ):
+    self.status_code = status_code
+    self.error = error
+    self.text = json.dumps({ "error": error })
+
+  def json( self ):
+    return { "error": self.error }
+
+class APIError(GSpreadException):
+
+  def __init__( self, code, message, status ):
+    error = { "code": code, "message": message, "status": status }
+    self.response = Response(code, error)
+    super( ).__init__(error)
+
+# gspread.exceptions, for code that catches sheets( ).exceptions.WorksheetNotFound
+exceptions = sys.modules[__name__]
+
+# column_index: the 0-based index of a column's letters, A is 0 and AA is 26
+def column_index( letters ):
+  index = 0
+  for letter in letters:
+    index = index * 26 + ord(letter) - ord('A') + 1
+  return index - 1
+
+cell_pattern = re.compile(r"^([A-Z]*)(\d*)$")
+
+# split_range: the tab name and cells of an A1 range, with the cells as 0-based (first row, first column,
+#   end row, end column), the ends exclusive.  Any part the range leaves open is None, so "A:ZZ" has no rows,
+#   "1:1" no columns, and a starting cell like "A2001" no end.
+def split_range( a1 ):
+  tab, bang, cells = a1.rpartition("!")
+  if not bang:
+    tab, cells = cells, ""
+  if len(tab) > 1 and tab[0] == tab[-1] == "'":
+    tab = tab[1:-1].replace("''", "'")
+  if not cells:
+    return tab, (None, None, None, None)
+
+  start, colon, end = cells.upper( ).partition(":")
+  first = cell_pattern.match(start)
+  last = cell_pattern.match(end if colon else start)
+  if not first or not last:
+    raise APIError(400, "Unable to parse range: {}".format(a1), "INVALID_ARGUMENT")
+  row0 = int(first.group(2)) - 1 if first.group(2) else None
+  col0 = column_index(first.group(1)) if first.group(1) else None
+  if not colon:
+    return tab, (row0, col0, None, None)
+  row1 = int(last.group(2)) if last.group(2) else None
+  col1 = column_index(last.group(1)) + 1 if last.group(1) else None
+  return tab, (row0, col0, row1, col1)
+
+# trimmed: rows without their trailing blank cells, or trailing blank rows, as the Sheets API returns values
+def trimmed( rows ):
+  rows = [row[:max((n + 1 for n, value in enumerate(row) if value != ""), default=0)] for row in rows]
+  while rows and not rows[-1]:
+    rows.pop( )
+  return rows
+
+# cell: a value as it is stored, always a string
+def cell( value ):
+  if value is None:
+    return ""
+  if value is True or value is False:
+    return "TRUE" if value else "FALSE"
+  return str(value)
+
+# Worksheet: one tab of a Spreadsheet.  Its id, title and size are known without a request, as in gspread.
+class Worksheet:
+
+  def __init__( self, spreadsheet, tab ):
+    self.spreadsheet = spreadsheet
+    self.tab = tab
+
+  @property
+  def id( self ):
+    return self.tab["id"]
+
+  @property
+  def title( self ):
+    return self.tab["title"]
+
+  @property
+  def row_count( self ):
+    return self.tab["rows"]
+
+  @property
+  def col_count( self ):
+    return self.tab["cols"]
+
+  def get_all_values( self ):
+    self.spreadsheet.client.request("get_all_values")
+    with self.spreadsheet.client.lock:
+      rows = trimmed(self.tab["values"])
+      width = max((len(row) for row in rows), default=0)
+      return [row + [""] * (width - len(row)) for row in rows]
+
+  def clear( self ):
+    self.spreadsheet.client.request("clear")
+    with self.spreadsheet.client.lock:
+      self.tab["values"] = []
+      self.spreadsheet.client.dirty = True
+
+  def resize( self, rows=None, cols=None ):
+    self.spreadsheet.client.request("resize")
+    with self.spreadsheet.client.lock:
+      if rows is not None:
+        self.tab["rows"] = rows
+        del self.tab["values"][rows:]
+      if cols is not None:
+        self.tab["cols"] = cols
+        for row in self.tab["values"]:
+          del row[cols:]
+      self.spreadsheet.client.dirty = True
+
+# Spreadsheet: one spreadsheet, with the values and batch_update requests the scripts send
+class Spreadsheet:
+
+  def __init__( self, client, state ):
+    self.client = client
+    self.state = state
+
+  @property
+  def id( self ):
+    return self.state["id"]
+
+  @property
+  def title( self ):
+    return self.state["title"]
+
+  @property
+  def sheet1( self ):
+    return Worksheet(self, self.state["tabs"][0])
+
+  # find_tab: the tab with this title or sheetId, or None
+  def find_tab( self, title=None, sheet_id=None ):
+    for tab in self.state["tabs"]:
+      if tab["title"] == title or tab["id"] == sheet_id:
+        return tab
+    return None
+
+  # grid: the tab with this sheetId, or a 400 error
+  def grid( self, sheet_id ):
+    tab = self.find_tab(sheet_id=sheet_id)
+    if tab is None:
+      raise APIError(400, "No grid with id: {}".format(sheet_id), "INVALID_ARGUMENT")
+    return tab
+
+  # new_tab: add a tab, after checking its title and sheetId are not already taken
+  def new_tab( self, title, rows, cols, sheet_id=None ):
+    if self.find_tab(title=title):
+      raise APIError(400, "Invalid requests[0].addSheet: A sheet with the name \"{}\" already exists. Please enter another name.".format(title), "INVALID_ARGUMENT")
+    if sheet_id is None:
+      sheet_id = self.client.random.randint(1, 2**31 - 1)
+    elif self.find_tab(sheet_id=sheet_id):
+      raise APIError(400, "Invalid requests[0].addSheet: Sheet with id {} already exists.".format(sheet_id), "INVALID_ARGUMENT")
+    tab = { "id": sheet_id, "title": title, "rows": rows, "cols": cols, "frozen_rows": 0, "values": [] }
+    self.state["tabs"].append(tab)
+    self.client.dirty = True
+    return tab
+
+  def worksheet( self, title ):
+    self.client.request("worksheet")
+    tab = self.find_tab(title=title)
+    if tab is None:
+      raise WorksheetNotFound(title)
+    return Worksheet(self, tab)
+
+  def worksheets( self ):
+    self.client.request("worksheets")
+    return [Worksheet(self, tab) for tab in self.state["tabs"]]
+
+  def add_worksheet( self, title, rows, cols, index=None ):
+    self.client.request("add_worksheet")
+    with self.client.lock:
+      return Worksheet(self, self.new_tab(title, int(rows), int(cols)))
+
+  def values_batch_get( self, ranges, params=None ):
+    self.client.request("values_batch_get", ranges)
+    value_ranges = []
+    with self.client.lock:
+      for a1 in ranges:
+        title, (row0, col0, row1, col1) = split_range(a1)
+        tab = self.find_tab(title=title)
+        if tab is None:
+          raise APIError(400, "Unable to parse range: {}".format(a1), "INVALID_ARGUMENT")
+        rows = trimmed([row[col0 or 0:col1] for row in tab["values"][row0 or 0:row1]])
+        value_range = { "range": a1, "majorDimension": "ROWS" }
+        if rows:
+          value_range["values"] = rows
+        value_ranges.append(value_range)
+    return { "spreadsheetId": self.id, "valueRanges": value_ranges }
+
+  def values_update( self, range, params=None, body=None ):
+    self.client.request("values_update", body)
+    values = (body or {}).get("values", [])
+    with self.client.lock:
+      title, (row0, col0, row1, col1) = split_range(range)
+      tab = self.find_tab(title=title)
+      if tab is None:
+        raise APIError(400, "Unable to parse range: {}".format(range), "INVALID_ARGUMENT")
+      row0, col0 = row0 or 0, col0 or 0
+      width = max((len(row) for row in values), default=0)
+      if row0 + len(values) > tab["rows"] or col0 + width > tab["cols"]:
+        raise APIError(400, "Range ({}) exceeds grid limits. Max rows: {}, max columns: {}".format(range, tab["rows"], tab["cols"]), "INVALID_ARGUMENT")
+      self.client.write(tab, row0, col0, values)
+    return { "spreadsheetId": self.id, "updatedRange": range, "updatedRows": len(values), "updatedColumns": width,
+      "updatedCells": sum(len(row) for row in values) }
+
+  # batch_update: apply every request in order.  Requests the stand-in doesn't know are refused, up front,
+  #   with a 400 and nothing applied.  Formatting requests are kept, as they were sent, but change no values.
+  def batch_update( self, body ):
+    self.client.request("batch_update", body)
+    requests = body.get("requests", [])
+    for n, request in enumerate(requests):
+      kind = next(iter(request), None)
+      if kind not in self.handlers:
+        raise APIError(400, "Invalid requests[{}]: {} is not supported by the stand-in".format(n, kind), "INVALID_ARGUMENT")
+    with self.client.lock:
+      replies = [getattr(self, self.handlers[kind])(request[kind]) for request in requests for kind in request]
+      self.client.dirty = True
+    return { "spreadsheetId": self.id, "replies": replies }
+
+  handlers = {
+    "addSheet": "add_sheet",
+    "pasteData": "paste_data",
+    "appendDimension": "append_dimension",
+    "deleteDimension": "delete_dimension",
+    "repeatCell": "formatting",
+    "addConditionalFormatRule": "formatting",
+  }
+
+  def add_sheet( self, request ):
+    properties = request.get("properties", {})
+    grid = properties.get("gridProperties", {})
+    title = properties.get("title") or "Sheet{}".format(len(self.state["tabs"]) + 1)
+    tab = self.new_tab(title, grid.get("rowCount", 1000), grid.get("columnCount", 26), properties.get("sheetId"))
+    tab["frozen_rows"] = grid.get("frozenRowCount", 0)
+    return { "addSheet": { "properties": { "sheetId": tab["id"], "title": tab["title"], "index": len(self.state["tabs"]) - 1,
+      "sheetType": "GRID", "gridProperties": { "rowCount": tab["rows"], "columnCount": tab["cols"], "frozenRowCount": tab["frozen_rows"] } } } }
+
+  # paste_data: paste .csv text at a cell, growing the grid to fit it
+  def paste_data( self, request ):
+    coordinate = request.get("coordinate", {})
+    tab = self.grid(coordinate.get("sheetId", 0))
+    rows = list(csv.reader(io.StringIO(request.get("data", "")), delimiter=request.get("delimiter", ",")))
+    row0, col0 = coordinate.get("rowIndex", 0), coordinate.get("columnIndex", 0)
+    tab["rows"] = max(tab["rows"], row0 + len(rows))
+    tab["cols"] = max(tab["cols"], col0 + max((len(row) for row in rows), default=0))
+    self.client.write(tab, row0, col0, rows)
+    return { }
+
+  def append_dimension( self, request ):
+    tab = self.grid(request.get("sheetId"))
+    tab["rows" if request.get("dimension") == "ROWS" else "cols"] += request.get("length", 0)
+    return { }
+
+  def delete_dimension( self, request ):
+    span = request.get("range", {})
+    tab = self.grid(span.get("sheetId"))
+    start, end = span.get("startIndex", 0), span.get("endIndex")
+    end = tab["rows" if span.get("dimension") == "ROWS" else "cols"] if end is None else end
+    if span.get("dimension") == "ROWS":
+      del tab["values"][start:end]
+      tab["rows"] -= end - start
+    else:
+      for row in tab["values"]:
+        del row[start:end]
+      tab["cols"] -= end - start
+    return { }
+
+  def formatting( self, request ):
+    self.state.setdefault("formats", []).append(request)
+    return { }
+
+# Client: the stand-in for an authorized gspread Client, and its state file.  Every request first waits out
+#   the latency, then is counted against the quota, and its payload checked, before it is carried out.
+class Client:
+
+  def __init__( self, state_file=None, **settings ):
+    self.state_file = state_file
+    self.state = { "settings": {}, "spreadsheets": [], "stats": {} }
+    if state_file and os.path.exists(state_file):
+      with open(state_file) as f:
+        self.state.update(json.load(f))
+    self.settings = dict(DEFAULT_SETTINGS, **self.state["settings"])
+    self.settings.update((key, value) for key, value in settings.items( ) if value is not None)
+    self.random = random.Random(self.settings["seed"])
+    self.lock = threading.RLock( )
+    self.recent = deque( )     # when each request of the last minute was accepted
+    self.stats = { "requests": 0, "quota_errors": 0, "payload_bytes": 0, "methods": {} }
+    self.dirty = False
+    if state_file:
+      atexit.register(self.save)
+
+  # request: one round trip to "Google", for `method` with this payload
+  def request( self, method, payload=None ):
+    size = len(json.dumps(payload)) if payload is not None else 0
+    if self.settings["latency"]:
+      time.sleep(self.settings["latency"])
+    with self.lock:
+      self.stats["requests"] += 1
+      self.stats["methods"][method] = self.stats["methods"].get(method, 0) + 1
+      self.stats["payload_bytes"] += size
+      now = time.monotonic( )
+      while self.recent and now - self.recent[0] >= 60:
+        self.recent.popleft( )
+      limited = self.settings["per_minute"] and len(self.recent) >= self.settings["per_minute"]
+      if limited or self.random.random( ) < self.settings["error_rate"]:
+        self.stats["quota_errors"] += 1
+        raise APIError(429, "Quota exceeded for quota metric 'Write requests' and limit 'Write requests per minute per user' of service 'sheets.googleapis.com'.", "RESOURCE_EXHAUSTED")
+      self.recent.append(now)
+    if size > self.settings["max_payload"]:
+      raise APIError(400, "Request payload size exceeds the limit: {} bytes.".format(self.settings["max_payload"]), "INVALID_ARGUMENT")
+
+  # write: write rows of values into a tab at (row0, col0), 0-based, padding out the rows and cells before them
+  def write( self, tab, row0, col0, rows ):
+    values = tab["values"]
+    if len(values) < row0 + len(rows):
+      values.extend([] for n in range(row0 + len(rows) - len(values)))
+    for n, row in enumerate(rows):
+      target = values[row0 + n]
+      if len(target) < col0 + len(row):
+        target.extend("" for n in range(col0 + len(row) - len(target)))
+      target[col0:col0 + len(row)] = [cell(value) for value in row]
+    self.dirty = True
+
+  def open( self, title ):
+    self.request("open")
+    for state in self.state["spreadsheets"]:
+      if state["title"] == title:
+        return Spreadsheet(self, state)
+    raise SpreadsheetNotFound(title)
+
+  def open_by_key( self, key ):
+    self.request("open_by_key")
+    for state in self.state["spreadsheets"]:
+      if state["id"] == key:
+        return Spreadsheet(self, state)
+    raise SpreadsheetNotFound(key)
+
+  def create( self, title ):
+    self.request("create")
+    with self.lock:
+      state = { "id": "standin-{:x}".format(self.random.getrandbits(64)), "title": title, "tabs": [] }
+      self.state["spreadsheets"].append(state)
+      spreadsheet = Spreadsheet(self, state)
+      spreadsheet.new_tab("Sheet1", 1000, 26, 0)
+    return spreadsheet
+
+  # save: write the spreadsheets back to the state file, if anything changed, along with the request counts
+  def save( self ):
+    with self.lock:
+      if not self.state_file or not (self.dirty or self.stats["requests"]):
+        return
+      totals = self.state.setdefault("stats", {})
+      for key in ("requests", "quota_errors", "payload_bytes"):
+        totals[key] = totals.get(key, 0) + self.stats[key]
+      methods = totals.setdefault("methods", {})
+      for method, count in self.stats["methods"].items( ):
+        methods[method] = methods.get(method, 0) + count
+      self.stats = { "requests": 0, "quota_errors": 0, "payload_bytes": 0, "methods": {} }
+      with open(self.state_file + ".tmp", 'w') as f:
+        json.dump(self.state, f)
+      os.replace(self.state_file + ".tmp", self.state_file)
+      self.dirty = False
+
+# service_account: the stand-in for gspread.service_account(), with the spreadsheets of the `state` file.
+#   `filename` is ignored, there are no credentials.  Any settings given override those of the state file.
+def service_account( filename=None, state=None, **settings ):
+  return Client(state, **settings)
+
+# load_spreadsheet: add or replace tabs of the `title` spreadsheet, creating it if need be, with the values of 
+#   local .csv files.  `tabs` is a list of (tab title, .csv path).
+def load_spreadsheet( client, title, tabs ):
+  state = next((state for state in client.state["spreadsheets"] if state["title"] == title), None)
+  if state is None:
+    state = { "id": "standin-{:x}".format(client.random.getrandbits(64)), "title": title, "tabs": [] }
+    client.state["spreadsheets"].append(state)
+  spreadsheet = Spreadsheet(client, state)
+  for tab, path in tabs:
+    with open(path, 'r', newline='') as data:
+      values = list(csv.reader(data))
+    state["tabs"] = [old for old in state["tabs"] if old["title"] != tab]
+    sheet_id = next(n for n in itertools.count( ) if spreadsheet.find_tab(sheet_id=n) is None)
+    new = spreadsheet.new_tab(tab, max(len(values), 1), max((len(row) for row in values), default=1), sheet_id)
+    client.write(new, 0, 0, values)
+  client.dirty = True
+  return spreadsheet
+
+######################################################################
+
+# Main...
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description="Make, configure or list the state file of the offline Google Sheets stand-in.")
+  parser.add_argument('state', help="the JSON state file, created if need be")
+  parser.add_argument('--spreadsheet', metavar='TITLE', help="the spreadsheet to create or add --tab's to")
+  parser.add_argument('--tab', action='append', default=[], metavar='TITLE=FILE', help="replace or add the TITLE tab with the values of a local .csv FILE, can be repeated")
+  parser.add_argument('--latency', type=float, metavar='SECONDS', help="add this many seconds to every request")
+  parser.add_argument('--max-payload', type=int, metavar='BYTES', help="refuse any request body larger than this (default 10 MB)")
+  parser.add_argument('--error-rate', type=float, metavar='P', help="refuse this fraction of requests with a 429, at random")
+  parser.add_argument('--per-minute', type=int, metavar='N', help="refuse requests beyond N a minute with a 429, 0 for no limit")
+  parser.add_argument('--seed', type=int, metavar='N', help="seed the random 429s")
+  args = parser.parse_args()
+
+  client = Client(args.state)
+  settings = { "latency": args.latency, "max_payload": args.max_payload, "error_rate": args.error_rate, "per_minute": args.per_minute, "seed": args.seed }
+  client.state["settings"].update((key, value) for key, value in settings.items( ) if value is not None)
+  client.dirty = any(value is not None for value in settings.values( ))
+
+  if args.tab and not args.spreadsheet:
+    parser.error("--tab needs a --spreadsheet to add it to")
+  if args.spreadsheet:
+    tabs = [tab.partition("=")[::2] for tab in args.tab]
+    for tab, (title, path) in zip(args.tab, tabs):
+      if not title or not path:
+        parser.error("--tab {} should be TITLE=FILE".format(tab))
+    load_spreadsheet(client, args.spreadsheet, tabs)
+
+  client.save( )
+  print("Settings: {}".format(", ".join("{}={}".format(key, value) for key, value in dict(DEFAULT_SETTINGS, **client.state["settings"]).items( ))))
+  for state in client.state["spreadsheets"]:
+    print("Spreadsheet '{}' ({})".format(state["title"], state["id"]))
+    for tab in state["tabs"]:
+      print("  tab '{}' (sheetId {}): {} x {} grid, {} rows of values".format(tab["title"], tab["id"], tab["rows"], tab["cols"], len(trimmed(tab["values"]))))
+  stats = client.state.get("stats", {})
+  if stats.get("requests"):
+    print("Requests so far: {requests}, {quota_errors} refused with a 429, {payload_bytes} payload bytes".format(**stats))
+    for method, count in sorted(stats["methods"].items( )):
+      print("  {}: {}".format(method, count))
@@ -0,0 +1,4 @@
+# transform_mods_cli
+##
+## The package behind transform-mods-csv-to-ready-for-CB.py.  Its code is in core.py, and core.main( ) is the
+## `transform-mods-csv-to-ready-for-CB` console_scripts entry point.
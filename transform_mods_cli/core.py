@@ -0,0 +1,1889 @@
+# transform_mods_cli/core.py
+##
+## The code of transform-mods-csv-to-ready-for-CB.py, kept in an importable module so that the script in the
+## checkout, the installed console_scripts entry point and the --workers processes (which import it by name
+## when multiprocessing spawns them) all load the same thing.
+##
+## This script, evolved from rootstalk-google-sheet-to-front-matter.py from my 
+## https://github.com/Digital-Grinnell/hugo-front-matter-tools project, is designed to read all 
+## exported MODS records from the `mods.csv` tab of  https://docs.google.com/spreadsheets/d/1ic4PxHDbuzDrmf4YtauhC4vEQJxt3QSH8bYfLBCM3Gc/edit#gid=935629805
+## and transform that data into a new ready-for-CB datetime-named tab of the same Google Sheet, but using the column 
+## heading/structure of the CollectionBuilder demo `Sheet1` tab.
+
+import time
+import_started = time.perf_counter( )
+
+# Only what every run needs is imported here.  gspread (with google-auth and requests), asyncio, ssl, sqlite3,
+# multiprocessing and cProfile are imported by the functions that use them, so a local run, or a cron job that
+# runs this many times an hour, doesn't pay for what it doesn't use.  --profile reports the import time.
+import os
+import csv
+import io
+import re
+import gzip
+import json
+import hashlib
+import random
+import atexit
+import argparse
+import functools
+import contextlib
+import itertools
+import threading
+import urllib.parse
+from collections import deque, UserDict
+from datetime import datetime
+
+import_seconds = time.perf_counter( ) - import_started
+
+# Populate the "transform" dict.  THIS IS CRITICAL!  
+# This dict maps MODS.csv headings either to a CB CSV heading, or to a function.
+transform = {
+  "PID": { "pid": "objectid" },
+  "WORKSPACE": None,
+  "Import_Index": { "tbd": None },
+  "PARENT": "parentid",
+  "CMODEL": { "cmodel_map": "display_template" },
+  "SEQUENCE": { "tbd": None },
+  "OBJ": { "obj": "object_location" },
+  "TRANSCRIPT": { "transcript": "transcript" },
+  "THUMBNAIL": { "thumbnail": "image_thumb" },
+  "Title": "title",
+  "Alternative_Titles": { "tbd": None },
+  "Personal_Names~Roles": { "name_with_attribute": "creator" },
+  "Corporate_Names~Roles": { "tbd": None },
+  "Abstract": "description",
+  "Index_Date": "date",
+  "Date_Issued": { "tbd": None },
+  "Date_Captured": { "tbd": None },
+  "Other_Date~Display_Label": { "tbd": None },
+  "Publisher": { "tbd": None },
+  "Place_Of_Publication": { "tbd": None },
+  "Public_Notes~Types": { "tbd": None },
+  "Notes~Display_Label": { "tbd": None },
+  "Dates_as_Notes~Display_Label": { "tbd": None },
+  "Citations": { "tbd": None },
+  "Table_of_Contents": { "tbd": None },
+  "LCSH_Subjects": { "tbd": None },
+  "Subjects_Names~Types": { "tbd": None },
+  "Subjects_Geographic": { "simple_list": "location" },
+  "Subjects_Temporal": { "tbd": None },
+  "Keywords": { "simple_list": "subject" },
+  "Coordinate": { "tbd": None },
+  "Related_Items~Types": { "tbd": None },
+  "Type_of_Resource~AuthorityURI": { "name_with_attribute": "type" },
+  "Genre~AuthorityURI": { "tbd": None },
+  "Extent": { "tbd": None },
+  "Form~AuthorityURI": { "tbd": None },
+  "MIME_Type": "format",
+  "Digital_Origin": { "tbd": None },
+  "Classifications~Authorities": { "tbd": None },
+  "Language_Names~Codes": "language",
+  "Local_Identifier": "identifier",
+  "Handle":	{ "tbd": None },
+  "Physical_Location": { "tbd": None },
+  "Shelf_Locator": { "tbd": None },
+  "Access_Condition": "rightsstatement",
+  "Import_Source": None,
+  "Primary_Sort": None,
+  "Hidden_Creator": { "tbd": None },
+  "Pull_Quotes": { "tbd": None },
+  "Private_Notes~Types": { "tbd": None }
+}
+
+required_by_CB = [
+  "objectid",
+  "title",
+  "display_template",
+  "object_location",
+  "image_small",
+  "image_thumb",
+  "format"
+]
+
+## Declare the CModels map to populate the `display_template` field
+# display_template:
+#
+#     A template type used for the Item page and used in logic to choose representations in other pages.
+#     If blank the object will default to a generic item page.
+#     Supported values in display_template match files found in “_layouts”.
+#     Default supported options: image, pdf, video, audio, record, item.
+#         image: Displays image_small if available, with fall back to object_location. Adds gallery view to open images full screen using object_location, with fall back to image_small.
+#         pdf: Displays image_small if available, with fall back to image_thumb, or a pdf icon.
+#         video: Displays a video embedded on the page with default support for video files (using <video> element with object_location as src), YouTube (from link in object_location), or Vimeo videos (from link in object_location).
+#         audio: Uses <audio> element to embed audio file from object_location as src.
+#         record: metadata only record.
+#         item: generic fallback item page, displays image or icon depending on “image_thumb”
+#     See “docs/item-pages.md” in your CollectionBuilder-CSV project repository for more details.
+
+CModels = {
+  "islandora:binaryObjectCModel": "item",
+  "islandora:bookCModel": "item",
+  "islandora:sp_pdf": "pdf",
+  "islandora:compoundCModel": "record",
+  "islandora:sp-audioCModel": "audio",
+  "islandora:oralhistoriesCModel": "oral-history",
+  "islandora:sp_large_image_cmodel": "image",
+  "islandora:sp_web_archive": "item",
+  "islandora:sp_videoCModel": "video",
+  "islandora:sp_basic_image": "image",
+  "islandora:pageCModel": "item"
+}
+
+# RecordContext: the state shared by the transform functions of ONE record, passed to every function as `ctx`.
+#   Functions read any raw MODS column of the record with ctx.source(), and set derived CB fields, like
+#   `image_small`, explicitly with ctx.set().  Nothing is carried between records, or between columns, in 
+#   module globals, so records give the same result in any order, in any process.  Both rows are plain lists,
+#   and `layout`, from row_layout(), maps headings to their indexes in them.
+class RecordContext:
+  __slots__ = ('record', 'columns', 'transformed', 'targets')
+
+  def __init__( self, record, layout, transformed ):
+    self.record = record              # the raw MODS record, a list in `old_headings` order
+    self.columns = layout[0]          # MODS heading -> index into record
+    self.transformed = transformed    # the CB row being built, a list in `new_headings` order
+    self.targets = layout[1]          # CB heading -> index into transformed
+
+  # source: the raw value of any MODS column of this record, or "" if the export has no such column
+  def source( self, column ):
+    index = self.columns.get(column)
+    if index is None:
+      return ""
+    return self.record[index]
+
+  # set: explicitly set a derived CB field of this record, if `Sheet1` has that heading
+  def set( self, heading, value ):
+    index = self.targets.get(heading)
+    if index is not None:
+      self.transformed[index] = value
+
+# datastream: the Islandora datastream URL of an object, e.g. datastream(obj_url, "TN") 
+def datastream( object_url, dsid ):
+  return "{}/datastream/{}/view".format(object_url, dsid)
+
+## Diagnostics...
+# Rather than a print() for every cell, transform functions note() each "skip it" or "don't know what to do" 
+# event.  Events are counted per (function, column, event) and reported ONCE, in report_diagnostics(), at the
+# end of the run along with up to `max_samples` example values.  Set `verbose` to get the old per-cell lines.
+
+SKIPPED = "maps to None, skip it!"
+UNKNOWN = "I don't know what to do!"
+UNMAPPED = "value is not in the vocabulary!"    # a KeyError, see transform_record()
+
+# LocalDict: a dict with separate contents in each thread, so the collections of a batch, each run in its own
+#   thread, keep their diagnostics and caches apart
+class LocalDict(threading.local, UserDict):
+  pass
+
+diagnostics = LocalDict( )     # (function, column, event) -> [count, [sample values]]
+verbose = False
+max_samples = 0
+unmapped_samples = 20   # the validation report lists this many distinct unmapped values, whatever max_samples is
+
+# samples_kept: how many distinct sample values to keep for an event
+def samples_kept( event ):
+  return max(max_samples, unmapped_samples) if event == UNMAPPED else max_samples
+
+# note: count one diagnostic event, keep a capped sample of its values, and print it only when verbose
+def note( func, column, value, event ):
+  entry = diagnostics.get((func, column, event))
+  if entry is None:
+    entry = diagnostics[(func, column, event)] = [0, []]
+  entry[0] += 1
+  if len(entry[1]) < samples_kept(event) and value not in entry[1]:
+    entry[1].append(value)
+  if verbose:
+    print("Function '{}' for column '{}' called with argument '{}': {}".format(func, column, value, event))
+
+# report_diagnostics: print the summary of all noted events, one line per (function, column, event)
+def report_diagnostics( ):
+  if not diagnostics:
+    return
+  print("Transform diagnostics:")
+  for (func, column, event), (count, samples) in sorted(diagnostics.items()):
+    print("  {:>9} x function '{}' for column '{}': {}".format(count, func, column, event))
+    if samples:
+      print("              e.g. {}".format(", ".join(repr(v) for v in samples)))
+
+## Memoized transforms...
+# Columns like CMODEL hold only a handful of distinct values across a whole collection.  A transform function
+# that depends on nothing but its value can be memoized, marked with @memoize(maxsize), and each of the
+# `memoized_columns` it is mapped from gets a bounded LRU cache from build_transform_plan(), so a repeated
+# value costs one lookup.  Only low-cardinality vocabulary columns are listed, a cache on a column of names or
+# keywords would hardly ever hit and just cost memory in every worker.  Hits and misses are counted per 
+# (function, column) and reported at the end of the run by report_caches().
+
+memoized_columns = { "CMODEL", "Type_of_Resource~AuthorityURI", "Subjects_Geographic" }
+
+sanitize_pattern = re.compile(r'[^\w\d-]')
+
+caches = LocalDict( )        # (function, column) -> the functools.lru_cache of that column, in this process
+cache_stats = LocalDict( )   # (function, column) -> [hits, misses] gathered from worker processes
+
+# memoize: mark a transform function as safe to memoize, for the `memoized_columns` mapped to it.  Its result 
+#   must depend on its value alone, it is called with ctx=None.
+def memoize( maxsize=1024 ):
+  def opt_in( func ):
+    func.memoize = maxsize
+    return func
+  return opt_in
+
+# memoized: func wrapped in a new LRU cache for one column
+def memoized( func, column, to ):
+  cache = functools.lru_cache(maxsize=func.memoize)(lambda value: func(value, column, to, None))
+  caches[(func.__name__, column)] = cache
+  @functools.wraps(func)
+  def cached_func( value, from_column, to, ctx ):
+    return cache(value)
+  return cached_func
+
+# take_cache_stats: the hits and misses of this process's caches since they were last taken
+taken = LocalDict( )
+def take_cache_stats( ):
+  stats = {}
+  for key, cache in caches.items():
+    info = cache.cache_info( )
+    hits, misses = taken.get(key, (0, 0))
+    stats[key] = [info.hits - hits, info.misses - misses]
+    taken[key] = (info.hits, info.misses)
+  return stats
+
+# merge_cache_stats: fold the cache stats of a worker into our own
+def merge_cache_stats( stats ):
+  for key, (hits, misses) in stats.items():
+    entry = cache_stats.setdefault(key, [0, 0])
+    entry[0] += hits
+    entry[1] += misses
+
+# report_caches: print the hits, misses and hit rate of every memoized column
+def report_caches( ):
+  merge_cache_stats(take_cache_stats( ))
+  if not cache_stats:
+    return
+  print("Memoized transforms:")
+  for (func, column), (hits, misses) in sorted(cache_stats.items()):
+    calls = hits + misses
+    print("  function '{}' for column '{}': {} hits, {} misses, {:.1f}% hit rate".format(func, column, hits, misses, 100.0 * hits / calls if calls else 0))
+
+## Profiling...
+# With --profile each function dispatched from the `transform` mapping is wrapped, by profile_plan(), in a
+# timer and call counter keyed by (function, column), and the read, transform/write and upload stages are 
+# timed the same way.  A reservoir of up to `profile_reservoir` timings per key is kept for the p99, so memory
+# stays bounded however many calls there are.  report_profile() prints the table at the end of the run.
+
+profiling = False
+profile = {}     # (function or stage, column) -> [calls, total seconds, [sampled seconds]]
+profile_reservoir = 2000
+
+# record_time: add one timing to a profile entry
+def record_time( key, seconds ):
+  entry = profile.get(key)
+  if entry is None:
+    entry = profile[key] = [0, 0.0, []]
+  entry[0] += 1
+  entry[1] += seconds
+  if len(entry[2]) < profile_reservoir:
+    entry[2].append(seconds)
+  else:
+    slot = random.randrange(entry[0])
+    if slot < profile_reservoir:
+      entry[2][slot] = seconds
+
+# profiled: wrap a transform function so every call is timed under (function, column)
+def profiled( func, column ):
+  key = (func.__name__, column)
+  @functools.wraps(func)
+  def timed_func( value, from_column, to, ctx ):
+    start = time.perf_counter( )
+    try:
+      return func(value, from_column, to, ctx)
+    finally:
+      record_time(key, time.perf_counter( ) - start)
+  return timed_func
+
+# profile_plan: the same plan with every function step wrapped by profiled()
+def profile_plan( plan ):
+  return [(index, column, profiled(func, column) if func else None, to, target) for index, column, func, to, target in plan]
+
+# profiled_records: pass records through, timing how long each takes to read
+def profiled_records( records ):
+  records = iter(records)
+  while True:
+    start = time.perf_counter( )
+    record = next(records, None)
+    if record is None:
+      return
+    record_time(("read", ""), time.perf_counter( ) - start)
+    yield record
+
+# stage: time a block of the run under (name, ""), when profiling
+@contextlib.contextmanager
+def stage( name ):
+  start = time.perf_counter( )
+  try:
+    yield
+  finally:
+    if profiling:
+      record_time((name, ""), time.perf_counter( ) - start)
+
+standin_state = None   # with --sheets-standin, the state file of the offline stand-in used instead of Google Sheets
+
+# sheets: the gspread module, imported the first time a Google Sheet is opened or written, or with 
+#   --sheets-standin, the offline stand-in for it, see sheets_standin.py
+def sheets( ):
+  if standin_state:
+    import sheets_standin
+    return sheets_standin
+  with stage("import gspread"):
+    import gspread
+  return gspread
+
+# service_account: an authorized client of Google Sheets, or of the stand-in
+def service_account( ):
+  if standin_state:
+    return sheets( ).service_account(state=standin_state)
+  return sheets( ).service_account( )
+
+# report_profile: print total time, calls, mean and p99 for every function and stage, slowest first
+def report_profile( ):
+  if not profile:
+    return
+  print("Profile:")
+  print("  {:<28} {:<32} {:>10} {:>11} {:>11} {:>11}".format("function / stage", "column", "calls", "total s", "mean ms", "p99 ms"))
+  for (name, column), (calls, total, samples) in sorted(profile.items(), key=lambda item: -item[1][1]):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print("  {:<28} {:<32} {:>10} {:>11.3f} {:>11.4f} {:>11.4f}".format(name, column, calls, total, 1000 * total / calls, 1000 * p99))
+
+# tbd: no transform defined at this time
+def tbd( value, from_column, to, ctx ):
+  if to is None:
+    note('tbd', from_column, value, SKIPPED)
+    return False
+  else:
+    note('tbd', from_column, value, UNKNOWN)
+  return value
+
+## Multi-valued MODS columns...
+# Our MODS exports pack several values into one cell, separated by '|', and in the "~" columns each value may
+# be followed by '~' and an attribute, e.g. "Smith, Mary~Author | Lee, John~Photographer".  A backslash escapes
+# either delimiter.  tokens() yields the (value, attribute) pairs of a cell one at a time, with surrounding 
+# whitespace trimmed and empty values dropped, and CB gets the values joined with "; ".
+#
+# Most cells have no backslash at all, and for those str.split() and str.partition() are the fastest single 
+# scan Python has, about three times faster than any regex.  Only cells with escapes take the precompiled 
+# pattern, which still matches each value and attribute as whole runs of ordinary characters.
+
+escaped_tokens = {
+  True: re.compile(r'([^|~\\]*(?:\\.?[^|~\\]*)*)(?:~([^|\\]*(?:\\.?[^|\\]*)*))?(?:\||$)'),
+  False: re.compile(r'([^|\\]*(?:\\.?[^|\\]*)*)()(?:\||$)'),
+}
+escape = re.compile(r'\\(.)')
+
+CB_SEPARATOR = "; "
+
+# tokens: the (value, attribute) pairs of a multi-valued cell.  Attribute is None when a value has none, or
+#   always when `attributes` is False and a '~' is just part of the value.
+def tokens( cell, attributes=True ):
+  if '\\' not in cell:
+    for item in cell.split('|'):
+      if attributes:
+        value, tilde, attribute = item.partition('~')
+      else:
+        value, attribute = item, ""
+      value = value.strip( )
+      if value:
+        yield value, attribute.strip( ) or None
+    return
+
+  for match in escaped_tokens[attributes].finditer(cell):
+    value, attribute = match.group(1, 2)
+    value = escape.sub(r'\1', value).strip( )
+    if value:
+      yield value, escape.sub(r'\1', attribute).strip( ) or None if attribute else None
+
+# name_with_attribute: a list of values, each with an optional '~' attribute, to translate into a single CB
+#   column of just the values, e.g. the names from `Personal_Names~Roles` become the CB `creator`
+@memoize(4096)
+def name_with_attribute( value, from_column, to, ctx ):
+  if to is None:
+    note('name_with_attribute', from_column, value, SKIPPED)
+    return False
+  return CB_SEPARATOR.join(name for name, attribute in tokens(value)) or False
+
+# pid: special handling for the object's PID
+def pid( value, from_column, to, ctx ):
+  if to is None:
+    note('pid', from_column, value, SKIPPED)
+    return False
+  else:
+    return sanitized(value, from_column, to, ctx)
+
+# sanitized: a string to be translated as-is to a new column AFTER file path sanitization
+def sanitized( value, from_column, to, ctx ):
+  if to is None:
+    note('sanitized', from_column, value, SKIPPED)
+    return False
+  else:
+    sanitized = sanitize_pattern.sub('_', value)
+    return sanitized
+
+# obj: the object URL and a special transform 
+def obj( value, from_column, to, ctx ):
+  if to is None:
+    note('obj', from_column, value, SKIPPED)
+    return False
+  else:
+    return datastream(value, "OBJ")
+
+# thumbnail: a TN datastream to populate the 'image_thumb' AND 'image_small' fields.  The TN URL comes from 
+#   this record's own OBJ value, so it does not matter which of the two columns is transformed first.
+def thumbnail( value, from_column, to, ctx ):
+  if to is None:
+    note('thumbnail', from_column, value, SKIPPED)
+    return False
+  thumbnail_image = datastream(ctx.source("OBJ"), "TN")
+  if value in thumbnail_image:
+    ctx.set('image_small', thumbnail_image)   # save the thumbnail as the `small_image`
+    return thumbnail_image
+  else:
+    return False  
+
+# filename: a filepath or URL to be transformed to a new column
+def filename( value, from_column, to, ctx ):
+  if to is None:
+    note('filename', from_column, value, SKIPPED)
+    return False
+  else:
+    return value 
+
+# simple_list: a simple list to translate into a single-value column.  A '~' here is just part of a value.
+@memoize(4096)
+def simple_list( value, from_column, to, ctx ):
+  if to is None:
+    note('simple_list', from_column, value, SKIPPED)
+    return False
+  return CB_SEPARATOR.join(item for item, nothing in tokens(value, attributes=False)) or False
+
+# cmodel_map: a single value from controlled vocab to translate into a single-value column
+@memoize(64)
+def cmodel_map( value, from_column, to, ctx ):
+  if to is None:
+    note('cmodel_map', from_column, value, SKIPPED)
+    return False
+  else:
+    return CModels[value]
+
+# is_quota_error: True if e is a Sheets API "429 Too Many Requests" (quota exceeded) error
+def is_quota_error( e ):
+  response = getattr(e, 'response', None)
+  if getattr(response, 'status_code', None) == 429:
+    return True
+  return '[429]' in str(e) or 'Quota exceeded' in str(e)
+
+# retry_on_quota: call func(*args, **kwargs), retrying quota errors up to `retries` times with exponential 
+#   backoff (plus a little jitter).  Any other error, or running out of retries, raises as usual.
+def retry_on_quota( func, *args, retries=6, backoff=1.0, **kwargs ):
+  for attempt in range(retries + 1):
+    try:
+      return func(*args, **kwargs)
+    except Exception as e:
+      if attempt == retries or not is_quota_error(e):
+        raise
+      delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+      print("Sheets quota exceeded, retrying in {:.1f} seconds...".format(delay))
+      time.sleep(delay)
+
+# a1_range: an A1 range, or starting cell, in the named tab.  Tab names are quoted since ours contain '-' and ':'
+def a1_range( tab, cells ):
+  return "'{}'!{}".format(tab.replace("'", "''"), cells)
+
+# Lifted from https://stackoverflow.com/questions/57264871/python-gspread-import-csv-to-specific-work-sheet
+#   ...then reworked to read csvFile `batch_rows` rows at a time and send each batch to the next A1 range of the
+#   sheetName tab, so neither our memory nor any one request grows with the size of the collection.  csvFile
+#   can be any of the output formats.  `sh` is anything with the gspread Spreadsheet.values_update() interface.
+#   The first `skip_rows` rows, already uploaded by an earlier run, are not sent again, and `progress`, if
+#   given, is called with the number of rows uploaded so far after each batch.  Returns the number of rows
+#   uploaded, including any skipped.
+def paste_csv( csvFile, sh, sheetName, batch_rows=2000, start_row=1, skip_rows=0, progress=None ):
+  nRows = skip_rows
+  with contextlib.closing(read_rows(csvFile)) as rows:
+    for row in itertools.islice(rows, skip_rows):
+      pass
+    for batch in chunked(rows, batch_rows):
+      retry_on_quota(sh.values_update,
+        a1_range(sheetName, "A{}".format(start_row + nRows)),
+        params={'valueInputOption': 'USER_ENTERED'},
+        body={'values': batch}
+      )
+      nRows += len(batch)
+      print("Uploaded {} rows to the '{}' tab...".format(nRows, sheetName))
+      if progress:
+        progress(nRows)
+  return nRows
+
+## Delta uploads...
+# Rather than pasting every row into a new tab, --target-tab compares the current contents of an existing CB tab
+# with `transformed.csv`, row by row, keyed by `objectid`.  Only the changed cells of each changed row, the 
+# appended rows, and the deleted rows are sent, all in ONE batch_update, so the upload grows with the size of 
+# the change rather than the size of the collection.  Changes are sent as pasteData requests, just like the 
+# USER_ENTERED values of a full upload.
+
+# csv_text: rows as .csv text, for a pasteData request
+def csv_text( rows ):
+  text = io.StringIO( )
+  csv.writer(text, lineterminator="\n").writerows(rows)
+  return text.getvalue( ).rstrip("\n")
+
+# paste_request: a pasteData request for `rows` with their top-left cell at (row_index, column_index), 0-based
+def paste_request( sheet_id, row_index, column_index, rows ):
+  return { 'pasteData': {
+    "coordinate": { "sheetId": sheet_id, "rowIndex": row_index, "columnIndex": column_index },
+    "data": csv_text(rows),
+    "type": 'PASTE_NORMAL',
+    "delimiter": ',',
+  }}
+
+# keyed_rows: each row with its (objectid, occurrence) key, so even duplicate objectids pair up one-to-one
+def keyed_rows( rows, key_index ):
+  seen = {}
+  for row in rows:
+    objectid = row[key_index] if key_index < len(row) else ""
+    seen[objectid] = seen.get(objectid, 0) + 1
+    yield (objectid, seen[objectid]), row
+
+# delta_requests: the batch_update requests that turn `existing`, the current values of a tab (row 1 the 
+#   headings), into the rows of csvFile.  `grid_rows` is the tab's current row count.  Returns the requests and
+#   a summary of the changes, or (None, None) if the headings differ and the tab needs a full rewrite.
+def delta_requests( existing, csvFile, sheet_id, grid_rows ):
+  with contextlib.closing(read_rows(csvFile)) as rows:
+    headings = next(rows, [])
+    if not existing or existing[0] != headings or "objectid" not in headings:
+      return None, None
+    width = len(headings)
+    key_index = headings.index("objectid")
+    current = { key: index for index, (key, row) in enumerate(keyed_rows(existing[1:], key_index), start=1) }
+
+    requests = []
+    appended = []
+    summary = dict(changed=0, appended=0, deleted=0, unchanged=0)
+    for key, row in keyed_rows(rows, key_index):
+      index = current.pop(key, None)
+      if index is None:
+        appended.append(row)
+        continue
+      old = existing[index] + [""] * (width - len(existing[index]))
+      changed = [column for column in range(width) if old[column] != row[column]]
+      if changed:
+        first, last = changed[0], changed[-1]
+        requests.append(paste_request(sheet_id, index, first, [row[first:last + 1]]))
+        summary['changed'] += 1
+      else:
+        summary['unchanged'] += 1
+
+  # Appended rows go after the last existing row, growing the grid first if need be
+  if appended:
+    needed = len(existing) + len(appended) - grid_rows
+    if needed > 0:
+      requests.append({ 'appendDimension': { "sheetId": sheet_id, "dimension": "ROWS", "length": needed } })
+    requests.append(paste_request(sheet_id, len(existing), 0, appended))
+    summary['appended'] = len(appended)
+
+  # Whatever is left in `current` is gone.  Delete those rows last, bottom up, so no other index shifts
+  deleted = sorted(current.values(), reverse=True)
+  summary['deleted'] = len(deleted)
+  while deleted:
+    end = start = deleted.pop(0)
+    while deleted and deleted[0] == start - 1:
+      start = deleted.pop(0)
+    requests.append({ 'deleteDimension': { "range": { "sheetId": sheet_id, "dimension": "ROWS", "startIndex": start, "endIndex": end + 1 } } })
+
+  return requests, summary
+
+# upload_delta: bring the existing target_tab up to date with csvFile, in a single batch_update if possible
+def upload_delta( csvFile, sh, target_tab, nRows, nCols, batch_rows ):
+  try:
+    ws = retry_on_quota(sh.worksheet, target_tab)
+  except sheets( ).exceptions.WorksheetNotFound:
+    print("Tab '{}' does not exist yet, creating it...".format(target_tab))
+    retry_on_quota(sh.add_worksheet, title=target_tab, rows=nRows, cols=nCols)
+    paste_csv(csvFile, sh, target_tab, batch_rows)
+    return
+
+  existing = retry_on_quota(ws.get_all_values)
+  requests, summary = delta_requests(existing, csvFile, ws.id, ws.row_count)
+  if requests is None:
+    print("The headings of tab '{}' have changed, rewriting all of it...".format(target_tab))
+    retry_on_quota(ws.clear)
+    retry_on_quota(ws.resize, rows=nRows, cols=nCols)
+    paste_csv(csvFile, sh, target_tab, batch_rows)
+    return
+
+  if requests:
+    retry_on_quota(sh.batch_update, { 'requests': requests })
+  print("Tab '{}': {changed} rows changed, {appended} appended, {deleted} deleted, {unchanged} unchanged".format(target_tab, **summary))
+
+# sheet_inputs: the old_headings, data_records (lists) and new_headings of spreadsheet `sh`, all from ONE batched
+#   read of the `mods.csv` values and the `Sheet1` headings.  The worksheets are never listed, so it makes no 
+#   difference how many old output tabs the spreadsheet holds.  values_batch_get() drops trailing blank cells,
+#   so each record is padded back out to the width of the headings.
+def sheet_inputs( sh ):
+  response = retry_on_quota(sh.values_batch_get, [a1_range("mods.csv", "A:ZZ"), a1_range("Sheet1", "1:1")])
+  mods, sheet1 = [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+  old_headings = mods[0] if mods else []
+  data_records = mods[1:]
+  width = len(old_headings)
+  for record in data_records:
+    if len(record) < width:
+      record += [""] * (width - len(record))
+  new_headings = sheet1[0] if sheet1 else []
+  return old_headings, data_records, new_headings
+
+# local_mods_records: a generator of MODS records (lists, in `old_headings` order) read one at a time from a 
+#   local .csv export of `mods.csv`.  The heading row is skipped and short rows are padded out with blanks.
+def local_mods_records( mods_csv ):
+  with open(mods_csv, 'r', newline='') as data:
+    reader = csv.reader(data)
+    width = len(next(reader, []))
+    for record in reader:
+      if len(record) < width:
+        record += [""] * (width - len(record))
+      yield record
+
+# local_headings: just the column headings from row 1 of a local .csv file, e.g. an export of `Sheet1`
+def local_headings( csv_file ):
+  with open(csv_file, 'r', newline='') as data:
+    return next(csv.reader(data), [])
+
+# build_transform_plan: walk `transform` ONCE for the given headings and compile it into an ordered list of
+#   (column index, column, function, target column, target index) steps.  A function of None means "save the 
+#   value as-is".
+#   Columns that map to None, directly or via a function, are dropped here so they cost nothing per record.
+#   Every problem found is reported at once, in a ValueError, before any record is touched.
+def build_transform_plan( old_headings, new_headings ):
+  plan = []
+  problems = []
+  for index, column in enumerate(old_headings):
+    if column not in transform:
+      problems.append("old_heading key '{}' does NOT exist in our 'transform' and needs to be accounted for!".format(column))
+      continue
+    t = transform[column]
+    if t is None:                       # NO transform, skip this column 
+      continue
+    elif isinstance(t, str):            # transform is a string, save it as-is
+      func, to = None, t
+    elif isinstance(t, dict) and len(t) == 1:    # dict, call the named function for processing
+      key, to = next(iter(t.items()))
+      func = globals().get(key)
+      if not callable(func):
+        problems.append("transform function '{}' for column '{}' does NOT exist!".format(key, column))
+        continue
+      if to is None:
+        continue
+      if hasattr(func, 'memoize') and column in memoized_columns:
+        func = memoized(func, column, to)
+    else:  
+      problems.append("transform[] for column '{}' is UNRECOGNIZED type '{}'".format(column, type(t)))
+      continue
+    if to not in new_headings:
+      problems.append("transform target '{}' for column '{}' is NOT one of the 'Sheet1' headings!".format(to, column))
+      continue
+    plan.append((index, column, func, to, new_headings.index(to)))
+
+  if problems:
+    raise ValueError("\n".join(problems))
+  return plan
+
+# column_indexes: map each heading to its (first) index in a row
+def column_indexes( headings ):
+  indexes = {}
+  for index, heading in enumerate(headings):
+    indexes.setdefault(heading, index)
+  return indexes
+
+# row_layout: everything shared by the rows of a run, the header-index maps of both the MODS records and the
+#   CB rows, and the width of a CB row
+def row_layout( old_headings, new_headings ):
+  return column_indexes(old_headings), column_indexes(new_headings), len(new_headings)
+
+# transform_record: apply each step of the compiled plan to one MODS record, returning a CB row as a list.
+#   Each value missing from a vocabulary is also added to `unmapped`, if given, as (function, column, value).
+def transform_record( record, plan, layout, unmapped=None ):
+  transformed = [None] * layout[2]
+  ctx = RecordContext(record, layout, transformed)
+  for index, column, func, to, target in plan:
+    if func is None:
+      transformed[target] = record[index]
+    else:
+      try:
+        r = func(record[index], column, to, ctx)
+      except KeyError:    # a value missing from a vocabulary, like an unknown CModel, leaves the field empty
+        note(func.__name__, column, record[index], UNMAPPED)
+        if unmapped is not None:
+          unmapped.append((func.__name__, column, record[index]))
+        continue
+      if r:
+        transformed[target] = r
+  return transformed
+
+## Parallel transforms...
+# Records are independent, so with `workers` > 1 they are split into chunks and transformed in a process pool.
+# Each worker compiles its own plan once, in init_worker(), and hands back its rows AND the diagnostics it noted.
+# Chunks are collected strictly in submission order, and only a few are ever in flight, so the output is 
+# identical to the serial path and memory stays flat even when the records are streamed.
+
+worker_plan = None
+worker_layout = None
+
+# init_worker: set up the module state of one worker process
+def init_worker( old_headings, new_headings, verbose_flag, samples ):
+  global worker_plan, worker_layout, verbose, max_samples
+  worker_plan = build_transform_plan(old_headings, new_headings)
+  worker_layout = row_layout(old_headings, new_headings)
+  verbose = verbose_flag
+  max_samples = samples
+
+# transform_chunk: transform one chunk of records in a worker process
+def transform_chunk( records ):
+  diagnostics.clear( )
+  rows = [transform_record(record, worker_plan, worker_layout) for record in records]
+  return rows, dict(diagnostics), take_cache_stats( )
+
+# merge_diagnostics: fold the diagnostics noted by a worker into our own
+def merge_diagnostics( noted ):
+  for key, (count, samples) in noted.items():
+    entry = diagnostics.setdefault(key, [0, []])
+    entry[0] += count
+    for value in samples:
+      if len(entry[1]) < samples_kept(key[2]) and value not in entry[1]:
+        entry[1].append(value)
+
+# chunked: split an iterable of records into lists of up to `size` records
+def chunked( records, size ):
+  records = iter(records)
+  while True:
+    chunk = list(itertools.islice(records, size))
+    if not chunk:
+      return
+    yield chunk
+
+# transformed_rows: a generator of transformed rows (lists in `new_headings` order), in the same order as the records
+def transformed_rows( records, plan, old_headings, new_headings, workers=1, chunk_size=1000 ):
+  if workers <= 1:
+    layout = row_layout(old_headings, new_headings)
+    for record in records:
+      yield transform_record(record, plan, layout)
+    return
+
+  import multiprocessing
+  with multiprocessing.Pool(workers, initializer=init_worker, initargs=(old_headings, new_headings, verbose, max_samples)) as pool:
+    pending = deque( )
+    for chunk in chunked(records, chunk_size):
+      pending.append(pool.apply_async(transform_chunk, (chunk,)))
+      if len(pending) >= 2 * workers:
+        rows, noted, stats = pending.popleft( ).get( )
+        merge_diagnostics(noted)
+        merge_cache_stats(stats)
+        yield from rows
+    while pending:
+      rows, noted, stats = pending.popleft( ).get( )
+      merge_diagnostics(noted)
+      merge_cache_stats(stats)
+      yield from rows
+
+## Incremental re-transforms...
+# A --cache database maps each record's PID to a hash of its raw MODS values, to its transformed CB row, and to
+# the values of it that were missing from a vocabulary.  Records that are unchanged since the last run come
+# straight from the cache, and their UNMAPPED values are noted again, so the validation report is the same
+# either way.  Only new or changed records are transformed, and PIDs that have disappeared from the export are
+# dropped.  The cache is keyed to a signature of this script and the headings, so any change to the mapping or
+# its functions starts it over, empty.
+
+# plan_signature: a hash of everything, other than a record itself, that decides how the record is transformed
+def plan_signature( old_headings, new_headings ):
+  signature = hashlib.sha1( )
+  with open(__file__, 'rb') as script:
+    signature.update(script.read( ))
+  signature.update(json.dumps([old_headings, new_headings]).encode( ))
+  return signature.hexdigest( )
+
+# open_cache: open (or create) the cache database, starting it over if it was built with a different signature
+def open_cache( cache_file, signature ):
+  import sqlite3
+  db = sqlite3.connect(cache_file)
+  db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+  found = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone( )
+  if found is None or found[0] != signature:
+    db.execute("DROP TABLE IF EXISTS rows")
+    db.execute("INSERT OR REPLACE INTO meta VALUES ('signature', ?)", (signature,))
+  db.execute("CREATE TABLE IF NOT EXISTS rows (pid TEXT PRIMARY KEY, source_hash TEXT, row TEXT, unmapped TEXT)")
+  db.commit( )
+  return db
+
+# cached_rows: like transformed_rows(), but only new or changed records are transformed.  `counts` is filled
+#   in with the number of records 'added', 'changed', 'removed' and 'unchanged' since the last run.
+def cached_rows( records, plan, old_headings, new_headings, cache_file, counts ):
+  db = open_cache(cache_file, plan_signature(old_headings, new_headings))
+  layout = row_layout(old_headings, new_headings)
+  pid_index = layout[0]["PID"]
+  counts.update(added=0, changed=0, removed=0, unchanged=0)
+  seen = set( )
+
+  try:
+    for record in records:
+      pid = record[pid_index]
+      source_hash = hashlib.sha1("\x1f".join(record).encode( )).hexdigest( )
+      cached = db.execute("SELECT source_hash, row, unmapped FROM rows WHERE pid = ?", (pid,)).fetchone( )
+      if cached is not None and cached[0] == source_hash:
+        row = json.loads(cached[1])
+        for func, column, value in json.loads(cached[2]):
+          note(func, column, value, UNMAPPED)
+        counts['unchanged'] += 1
+      else:
+        unmapped = []
+        row = transform_record(record, plan, layout, unmapped)
+        db.execute("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)", (pid, source_hash, json.dumps(row), json.dumps(unmapped)))
+        counts['added' if cached is None else 'changed'] += 1
+      seen.add(pid)
+      yield row
+
+    # Anything left in the cache that wasn't seen this time has been removed from the export
+    removed = [(pid,) for (pid,) in db.execute("SELECT pid FROM rows") if pid not in seen]
+    db.executemany("DELETE FROM rows WHERE pid = ?", removed)
+    counts['removed'] = len(removed)
+    db.commit( )
+  finally:
+    db.close( )
+
+## Validation...
+# validated_rows() checks each row of the final output, as resolve_parents() rewrites it, so compound parents
+# are validated with the thumbnails they inherit and no pass over the output is added just to validate it.
+# It counts the rows missing each `required_by_CB` field, with a few example objectids, and keeps every 
+# objectid as an 8-byte digest in a set, which is all it takes to spot duplicates.  Values missing from a
+# vocabulary, like an unknown CModel and so an invalid `display_template`, are noted as UNMAPPED diagnostics 
+# by transform_record() and gathered into the report by finish_validation().  With fail_fast, the first 
+# problem raises ValidationFailed.
+
+class ValidationFailed(Exception):
+  pass
+
+# new_validation: an empty validation report for rows with these headings
+def new_validation( new_headings ):
+  return {
+    "rows": 0,
+    "missing_columns": [heading for heading in required_by_CB if heading not in new_headings],
+    "missing_values": {},         # heading -> { "count": rows, "objectids": [examples] }
+    "duplicate_objectids": {},    # objectid -> times seen
+    "unmapped_values": {},        # column -> { "function", "target", "count", "values" }
+    "broken_links": None,         # { "count", "examples": [{ "url", "status", "error", "objectid" }] } with --check-links
+    "valid": True,
+  }
+
+# validated_rows: pass rows through, unchanged, validating each one into `report`
+def validated_rows( rows, new_headings, report, fail_fast=False ):
+  required = [(heading, index) for index, heading in enumerate(new_headings) if heading in required_by_CB]
+  key = new_headings.index("objectid") if "objectid" in new_headings else None
+  missing = report["missing_values"]
+  duplicates = report["duplicate_objectids"]
+  seen = set( )
+
+  for row in rows:
+    report["rows"] += 1
+    objectid = row[key] if key is not None else None
+    problem = None
+
+    for heading, index in required:
+      if not row[index]:
+        entry = missing.get(heading)
+        if entry is None:
+          entry = missing[heading] = { "count": 0, "objectids": [] }
+        entry["count"] += 1
+        if len(entry["objectids"]) < 10:
+          entry["objectids"].append(objectid or "row {}".format(report["rows"] + 1))
+        problem = problem or "no {}".format(heading)
+
+    if objectid:
+      digest = hashlib.blake2b(objectid.encode( ), digest_size=8).digest( )
+      if digest in seen:
+        duplicates[objectid] = duplicates.get(objectid, 1) + 1
+        problem = problem or "a duplicate objectid"
+      else:
+        seen.add(digest)
+
+    if problem and fail_fast:
+      raise ValidationFailed("Row {} ({}) has {}".format(report["rows"] + 1, objectid, problem))
+    yield row
+
+# finish_validation: gather the UNMAPPED diagnostics into the report, and decide if the output is valid
+def finish_validation( report, plan ):
+  targets = { column: to for index, column, func, to, target in plan }
+  for (func, column, event), (count, samples) in diagnostics.items():
+    if event == UNMAPPED:
+      report["unmapped_values"][column] = { "function": func, "target": targets.get(column), "count": count, "values": samples }
+  broken = report["broken_links"] and report["broken_links"]["count"]
+  report["valid"] = not (report["missing_columns"] or report["missing_values"] or report["duplicate_objectids"] or report["unmapped_values"] or broken)
+  return report
+
+# report_validation: print a short summary of the validation report
+def report_validation( report ):
+  if report["valid"]:
+    print("Validation: all {} rows have every required field and a unique objectid".format(report["rows"]))
+    return
+  print("Validation problems:")
+  for heading in report["missing_columns"]:
+    print("  'Sheet1' has no '{}' column, it is required by CB".format(heading))
+  for heading, entry in report["missing_values"].items():
+    print("  {:>9} rows have no '{}', e.g. {}".format(entry["count"], heading, ", ".join(entry["objectids"][:3])))
+  if report["duplicate_objectids"]:
+    print("  {:>9} objectids are duplicated, e.g. {}".format(len(report["duplicate_objectids"]), ", ".join(list(report["duplicate_objectids"])[:3])))
+  for column, entry in report["unmapped_values"].items():
+    print("  {:>9} '{}' values are not in the '{}' vocabulary, so '{}' is empty: {}".format(entry["count"], column, entry["function"], entry["target"], ", ".join(repr(v) for v in entry["values"])))
+  if report["broken_links"] and report["broken_links"]["count"]:
+    print("  {:>9} links are broken, e.g.".format(report["broken_links"]["count"]))
+    for link in report["broken_links"]["examples"][:5]:
+      print("              {} ({}) for {}".format(link["url"], link["error"] or link["status"], link["objectid"]))
+
+## Output formats...
+# The transformed rows can be written as plain CSV, gzip-compressed CSV, NDJSON (one JSON object per row, 
+# keyed by heading) or columnar Parquet, chosen by the extension of the output file.  Each format is a
+# RowWriter that buffers up to `batch_rows` rows and writes them out a batch at a time, a Parquet batch being
+# one row group, so memory stays bounded however large the collection is.  Each format can also read its rows
+# back, headings first and every value as a string, for resolve_parents() and the uploads.  Only plain CSV 
+# and NDJSON can be truncated back to a committed byte offset and appended to, so only they can be resumed 
+# part way through the transform.  Parquet needs pyarrow, which is only imported when it is used.
+
+# cell_text: a value read back from NDJSON or Parquet as the string CSV would give
+def cell_text( value ):
+  return "" if value is None else str(value)
+
+# RowWriter: the batching shared by every output format
+class RowWriter:
+  resumable = False   # True if the file can be truncated to a committed offset and appended to
+
+  def __init__( self, path, headings, batch_rows=10000, offset=None ):
+    self.headings = headings
+    self.batch_rows = batch_rows
+    self.batch = []
+    self.file = self.start(path, offset)
+
+  def write( self, row ):
+    self.batch.append(row)
+    if len(self.batch) >= self.batch_rows:
+      self.flush( )
+
+  # flush: write out the batch.  It is dropped even if that fails, so close( ) doesn't try it again
+  def flush( self ):
+    if self.batch:
+      try:
+        self.write_batch(self.batch)
+      finally:
+        self.batch = []
+
+  # commit: write out every row so far, to disk, and return the byte offset they end at
+  def commit( self ):
+    self.flush( )
+    self.file.flush( )
+    os.fsync(self.file.fileno( ))
+    return self.file.tell( )
+
+  def close( self ):
+    self.flush( )
+    self.file.close( )
+
+# CsvWriter: plain CSV, the default
+class CsvWriter(RowWriter):
+  resumable = True
+
+  def start( self, path, offset ):
+    f = open(path, 'w' if offset is None else 'r+', newline='')
+    self.csvwriter = csv.writer(f)
+    if offset is None:
+      self.csvwriter.writerow(self.headings)
+    else:
+      f.seek(offset)
+      f.truncate( )
+    return f
+
+  def write_batch( self, rows ):
+    self.csvwriter.writerows(rows)
+
+  @staticmethod
+  def read( path ):
+    with open(path, 'r', newline='') as data:
+      yield from csv.reader(data)
+
+# GzipCsvWriter: CSV, gzip-compressed
+class GzipCsvWriter(CsvWriter):
+  resumable = False
+
+  def start( self, path, offset ):
+    f = gzip.open(path, 'wt', newline='', compresslevel=6)
+    self.csvwriter = csv.writer(f)
+    self.csvwriter.writerow(self.headings)
+    return f
+
+  @staticmethod
+  def read( path ):
+    with gzip.open(path, 'rt', newline='') as data:
+      yield from csv.reader(data)
+
+# NdjsonWriter: one JSON object per line, keyed by heading.  Empty values are null.
+class NdjsonWriter(RowWriter):
+  resumable = True
+
+  def start( self, path, offset ):
+    f = open(path, 'w' if offset is None else 'r+', newline='', encoding='utf-8')
+    if offset is not None:
+      f.seek(offset)
+      f.truncate( )
+    return f
+
+  def write_batch( self, rows ):
+    headings = self.headings
+    self.file.write("".join(json.dumps({ heading: value or None for heading, value in zip(headings, row) }, ensure_ascii=False) + "\n" for row in rows))
+
+  @staticmethod
+  def read( path ):
+    headings = None
+    with open(path, 'r', newline='', encoding='utf-8') as data:
+      for line in data:
+        record = json.loads(line)
+        if headings is None:
+          headings = list(record)
+          yield headings
+        yield [cell_text(record.get(heading)) for heading in headings]
+
+# ParquetWriter: columnar Parquet, every column a string, one row group per batch.  Empty values are null.
+class ParquetWriter(RowWriter):
+
+  def start( self, path, offset ):
+    import pyarrow
+    import pyarrow.parquet
+    self.pa = pyarrow
+    self.schema = pyarrow.schema([(heading, pyarrow.string( )) for heading in self.headings])
+    return pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+  def write_batch( self, rows ):
+    pa = self.pa
+    columns = [pa.array([str(value) if value else None for value in column], pa.string( )) for column in zip(*rows)]
+    self.file.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+  def commit( self ):
+    self.flush( )
+    return None
+
+  @staticmethod
+  def read( path ):
+    import pyarrow.parquet
+    parquet = pyarrow.parquet.ParquetFile(path)
+    yield list(parquet.schema_arrow.names)
+    for batch in parquet.iter_batches(batch_size=10000):
+      for row in zip(*(column.to_pylist( ) for column in batch.columns)):
+        yield [cell_text(value) for value in row]
+
+output_formats = { ".csv": CsvWriter, ".csv.gz": GzipCsvWriter, ".ndjson": NdjsonWriter, ".jsonl": NdjsonWriter, ".parquet": ParquetWriter }
+
+# output_writer: the RowWriter class for a file, chosen by its extension, or None if it has none we know
+def output_writer( path ):
+  for extension, writer in output_formats.items():
+    if path.endswith(extension):
+      return writer
+  return None
+
+# read_rows: a generator of the rows of any output file, headings first
+def read_rows( path ):
+  return output_writer(path).read(path)
+
+# write_transformed: write each transformed row to `output`, in its format, as it arrives.  Returns the number
+#   of rows written.  A row that can't be written stops the run, which the checkpoint can then resume.  Given a
+#   checkpoint, it is committed every `every` rows (if the format can be resumed) and once more at the end, and
+#   if the checkpoint is being resumed the rows it already holds are kept and the new rows are appended to them.
+def write_transformed( rows, new_headings, output, checkpoint=None, checkpoint_file=None, every=10000 ):
+  done = checkpoint["rows"] if checkpoint else 0
+  key = new_headings.index("objectid") if "objectid" in new_headings else None
+  last = None
+
+  # Resuming drops anything written after the last commit
+  writer = output_writer(output)(output, new_headings, offset=checkpoint["offset"] if done else None)
+  nRows = 1 + done
+
+  # Loop on each transformed row and write it before the next one is transformed
+  try:
+    for row in rows:
+      writer.write(row)
+      nRows += 1
+      done += 1
+      last = row
+      if checkpoint is not None and writer.resumable and done % every == 0:
+        commit_checkpoint(checkpoint_file, checkpoint, writer.commit( ), rows=done, objectid=row[key] if key is not None else None)
+  finally:
+    writer.close( )
+
+  if checkpoint is not None:
+    objectid = last[key] if last is not None and key is not None else checkpoint["objectid"]
+    commit_checkpoint(checkpoint_file, checkpoint, os.path.getsize(output), rows=done, objectid=objectid, written=True)
+
+  return nRows
+
+## Checkpoints...
+# A long run can die part way through, on a Sheets quota error, a network drop or a bad `CModels` key, and
+# without a checkpoint it starts over from the first record.  Every `every` rows write_transformed() flushes
+# the output to disk and commits, to a small JSON checkpoint beside it, the number of rows written, the byte
+# offset they end at, the objectid (the sanitized PID) of the last one, and the diagnostics noted so far.  
+# Formats that can't be resumed part way, gzip and Parquet, are only committed once they are complete.
+# The checkpoint also records when the compound objects are resolved, and which tab the upload goes to and how
+# many rows of it have been sent.  With --resume, a run of the same script and headings over the same source
+# truncates the output back to the last commit, skips the committed records without transforming them,
+# rebuilds the validation state from the committed rows, and uploads from the first row not yet sent.  The 
+# checkpoint is removed once a run completes.  --target-tab needs none of this, its delta is computed from 
+# whatever the tab holds now.
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# new_checkpoint: the checkpoint of a run that has done nothing yet
+def new_checkpoint( signature, source ):
+  return {
+    "signature": signature,   # plan_signature() of the script and headings
+    "source": source,         # the local MODS export, or the Google Sheet
+    "rows": 0,                # data rows committed to the output
+    "offset": 0,              # the byte offset of the end of those rows
+    "objectid": None,         # the objectid of the last of them
+    "diagnostics": [],        # [function, column, event, count, samples] noted for those rows
+    "written": False,         # every row is written
+    "resolved": False,        # resolve_parents() is done
+    "tab": None,              # the tab being uploaded to
+    "uploaded": 0,            # rows of the output uploaded to it, including the headings
+  }
+
+# save_checkpoint: apply any changes to the checkpoint and save it, atomically so a crash never leaves half of one
+def save_checkpoint( checkpoint_file, checkpoint, **changes ):
+  checkpoint.update(changes)
+  with open(checkpoint_file + ".tmp", 'w') as f:
+    json.dump(checkpoint, f)
+  os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+# commit_checkpoint: save the checkpoint with the offset the output is committed to, and our diagnostics
+def commit_checkpoint( checkpoint_file, checkpoint, offset, **changes ):
+  noted = [[func, column, event, count, samples] for (func, column, event), (count, samples) in diagnostics.items()]
+  save_checkpoint(checkpoint_file, checkpoint, offset=offset, diagnostics=noted, **changes)
+
+# load_checkpoint: the checkpoint to resume, or None if there isn't one this run can use
+def load_checkpoint( checkpoint_file, signature, source, csv_file ):
+  try:
+    with open(checkpoint_file) as f:
+      checkpoint = json.load(f)
+  except FileNotFoundError:
+    print("There is no checkpoint '{}' to resume".format(checkpoint_file))
+    return None
+  except Exception as e:
+    print(e)
+    return None
+
+  if checkpoint.get("signature") != signature or checkpoint.get("source") != source:
+    print("The checkpoint '{}' is from a different version of the script, different headings or a different source".format(checkpoint_file))
+    return None
+  if checkpoint["rows"] and not os.path.exists(csv_file):
+    print("'{}' is missing, it can't be resumed".format(csv_file))
+    return None
+  if checkpoint["rows"] and not checkpoint["written"] and (checkpoint["offset"] is None or os.path.getsize(csv_file) < checkpoint["offset"]):
+    print("'{}' is shorter than its checkpoint '{}'".format(csv_file, checkpoint_file))
+    return None
+  return checkpoint
+
+# resume_records: the records after those committed in the checkpoint, which are skipped without being 
+#   transformed.  Returns None if the last record skipped isn't the one the checkpoint ended on.
+def resume_records( records, checkpoint, pid_index ):
+  records = iter(records)
+  last = None
+  for last in itertools.islice(records, checkpoint["rows"]):
+    pass
+  if checkpoint["rows"] and pid_index is not None and checkpoint["objectid"] is not None:
+    if last is None or sanitize_pattern.sub('_', last[pid_index]) != checkpoint["objectid"]:
+      return None
+  return records
+
+# written_rows: the first `count` data rows of an output file, as written by write_transformed()
+def written_rows( output, count ):
+  with contextlib.closing(read_rows(output)) as rows:
+    yield from itertools.islice(rows, 1, count + 1)
+
+## Link checking...
+# obj() and thumbnail() build `.../datastream/OBJ/view` and `.../datastream/TN/view` URLs without knowing if
+# they exist, and a broken one only turns up on the published CB site.  With --check-links every distinct URL
+# in the LINK_COLUMNS of the output gets a HEAD request.  The requests are made by `concurrency` asyncio tasks,
+# each keeping its own connections alive between requests, so at most `concurrency` are ever in flight.  The
+# status of each URL goes into a SQLite link cache, and a URL checked within the last `ttl` seconds isn't 
+# checked again, so a re-run only checks the new ones.  Only HTTP statuses are cached, not connection errors.
+# `base`, e.g. the http://127.0.0.1:8000 of a local stub server, replaces the scheme and host of every URL 
+# when it is checked, which is how the checker is tested without touching the real repository.
+
+LINK_COLUMNS = ("object_location", "image_thumb", "image_small")
+
+# head_request: send one HEAD request on an open connection, return the status and whether to keep it alive
+async def head_request( reader, writer, host, path ):
+  writer.write("HEAD {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: transform-mods-csv-to-ready-for-CB\r\n\r\n".format(path, host).encode( ))
+  await writer.drain( )
+  status_line = await reader.readline( )
+  if not status_line:
+    raise ConnectionResetError("connection closed by the server")
+  version, status = status_line.split(None, 2)[:2]
+  keep_alive = version == b"HTTP/1.1"
+  while True:
+    line = await reader.readline( )
+    if line in (b"\r\n", b"\n", b""):
+      break
+    name, _, value = line.partition(b":")
+    if name.strip( ).lower( ) == b"connection":
+      token = value.strip( ).lower( )
+      keep_alive = token != b"close" if version == b"HTTP/1.1" else token == b"keep-alive"
+  return int(status), keep_alive
+
+# head_status: the status of a HEAD request for url, reusing a kept-alive connection from `connections` if 
+#   there is one.  A kept-alive connection the server has since closed is retried once on a new one.
+async def head_status( url, connections, timeout, base=None ):
+  import ssl
+  import asyncio
+  parts = urllib.parse.urlsplit(url)
+  if base:
+    parts = parts._replace(scheme=urllib.parse.urlsplit(base).scheme, netloc=urllib.parse.urlsplit(base).netloc)
+  https = parts.scheme == 'https'
+  port = parts.port or (443 if https else 80)
+  key = (parts.scheme, parts.hostname, port)
+  path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+  while True:
+    connection = connections.pop(key, None)
+    reused = connection is not None
+    if not reused:
+      connection = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context( ) if https else None), timeout)
+    reader, writer = connection
+    try:
+      status, keep_alive = await asyncio.wait_for(head_request(reader, writer, parts.netloc, path), timeout)
+    except (ConnectionError, asyncio.IncompleteReadError):
+      writer.close( )
+      if reused:
+        continue
+      raise
+    except BaseException:
+      writer.close( )
+      raise
+    if keep_alive:
+      connections[key] = connection
+    else:
+      writer.close( )
+    return status
+
+# check_links: HEAD every url, `concurrency` at a time, returns { url: (status, error) }.  A url with no 
+#   response is tried `retries` more times, and if there still isn't one its status is 0.
+async def check_links( urls, concurrency=32, timeout=10.0, base=None, retries=1 ):
+  import asyncio
+  results = {}
+  urls = iter(urls)
+
+  async def checker( ):
+    connections = {}
+    try:
+      for url in urls:
+        for attempt in range(retries + 1):
+          try:
+            results[url] = (await head_status(url, connections, timeout, base), None)
+            break
+          except Exception as e:
+            results[url] = (0, str(e) or type(e).__name__)
+    finally:
+      for reader, writer in connections.values( ):
+        writer.close( )
+
+  await asyncio.gather(*(checker( ) for n in range(concurrency)))
+  return results
+
+# open_link_cache: open (or create) the link cache database
+def open_link_cache( cache_file ):
+  import sqlite3
+  db = sqlite3.connect(cache_file)
+  db.execute("CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, status INTEGER, checked REAL)")
+  return db
+
+# check_output_links: check every distinct link in the output, skipping those in the cache that are younger 
+#   than `ttl` seconds.  Returns the broken links, in the form of the validation report, and `counts` is
+#   filled in with the number of 'links', how many were 'cached' and how many were 'checked'.
+def check_output_links( output, cache_file, ttl, concurrency, counts, timeout=10.0, base=None, examples=100 ):
+  import asyncio
+  links = {}   # url -> the objectid of the first row it's in
+  with contextlib.closing(read_rows(output)) as rows:
+    headings = next(rows, [])
+    columns = [index for index, heading in enumerate(headings) if heading in LINK_COLUMNS]
+    key = headings.index("objectid") if "objectid" in headings else None
+    for row in rows:
+      for index in columns:
+        if row[index] and row[index] not in links:
+          links[row[index]] = row[key] if key is not None else ""
+
+  db = open_link_cache(cache_file)
+  try:
+    now = time.time( )
+    statuses = { url: (status, None) for url, status in db.execute("SELECT url, status FROM links WHERE checked >= ?", (now - ttl,)) if url in links }
+    pending = [url for url in links if url not in statuses]
+    counts.update(links=len(links), cached=len(statuses), checked=len(pending))
+    checked = asyncio.run(check_links(pending, concurrency, timeout, base))
+    db.executemany("INSERT OR REPLACE INTO links VALUES (?, ?, ?)", [(url, status, now) for url, (status, error) in checked.items() if status])
+    db.commit( )
+  finally:
+    db.close( )
+
+  statuses.update(checked)
+  broken = { "count": 0, "examples": [] }
+  for url, objectid in links.items():
+    status, error = statuses[url]
+    if status == 0 or status >= 400:
+      broken["count"] += 1
+      if len(broken["examples"]) < examples:
+        broken["examples"].append({ "url": url, "status": status, "error": error, "objectid": objectid })
+  return broken
+
+## Compound objects...
+# Each child names its parent in PARENT, as a raw PID, but CB keys objects by their sanitized `objectid`, and
+# parents learn nothing from their children.  Once every row is written, resolve_parents() makes two linear 
+# passes over the output.  The first builds a hash index of every objectid, a count of each parent's children,
+# and the images of each parent's first child with a thumbnail.  The second rewrites every row with:
+#   - its `parentid` resolved to the parent's objectid, or blank if the parent is not an object in this 
+#     collection (most often it is the collection itself),
+#   - its number of children, in a `child_count` column if `Sheet1` has one,
+#   - the `image_thumb` and `image_small` of its first child, if it is a parent with no thumbnail of its own.
+# Only the index is held in memory, never the rows, and the output is rewritten in its own format.
+
+CHILD_COUNT = "child_count"
+
+# resolve_parents: resolve the compound objects of csv_file in place, and return a summary of what was done,
+#   or None if the output has no objectid and parentid.  `check`, if given, wraps the resolved rows on their
+#   way back to the file, see validated_rows().
+def resolve_parents( csv_file, check=None ):
+  with contextlib.closing(read_rows(csv_file)) as rows:
+    headings = next(rows, [])
+    if "objectid" not in headings or "parentid" not in headings:
+      return None
+    columns = column_indexes(headings)
+    objectid, parentid = columns["objectid"], columns["parentid"]
+    thumb, small = columns.get("image_thumb"), columns.get("image_small")
+
+    objectids = set( )
+    children = {}
+    first_images = {}
+    for row in rows:
+      objectids.add(row[objectid])
+      parent = sanitize_pattern.sub('_', row[parentid])
+      if parent:
+        children[parent] = children.get(parent, 0) + 1
+        if thumb is not None and row[thumb] and parent not in first_images:
+          first_images[parent] = (row[thumb], row[small] if small is not None else "")
+
+  summary = dict(children=0, parents=0, unresolved=0, inherited=0)
+  count = columns.get(CHILD_COUNT)
+
+  # resolved: each row with its parentid, child_count and images resolved
+  def resolved( rows ):
+    for row in rows:
+      parent = sanitize_pattern.sub('_', row[parentid])
+      if parent in objectids and parent != row[objectid]:
+        row[parentid] = parent
+        summary['children'] += 1
+      elif parent:
+        row[parentid] = ""
+        summary['unresolved'] += 1
+
+      n = children.get(row[objectid], 0)
+      if n:
+        summary['parents'] += 1
+        if count is not None:
+          row[count] = n
+        if thumb is not None and not row[thumb] and row[objectid] in first_images:
+          row[thumb], image_small = first_images[row[objectid]]
+          if small is not None and not row[small]:
+            row[small] = image_small
+          summary['inherited'] += 1
+      yield row
+
+  # A row that fails the check leaves the output as it was, unresolved
+  writer = output_writer(csv_file)(csv_file + ".tmp", headings)
+  try:
+    with contextlib.closing(read_rows(csv_file)) as rows:
+      next(rows)
+      rows = resolved(rows)
+      for row in check(rows) if check else rows:
+        writer.write(row)
+  except BaseException:
+    writer.close( )
+    os.remove(csv_file + ".tmp")
+    raise
+  writer.close( )
+
+  os.replace(csv_file + ".tmp", csv_file)
+  return summary
+
+## Batch mode...
+# --manifest runs many collections in one go, for instance every `CB-CSV_*` sheet of a migration.  The 
+# manifest is a .csv with a row per collection, naming either its `sheet`, or its `mods_csv` and `headings` 
+# exports, and optionally its own `output`, `target_tab`, `cache` and `report`.  Every other option comes from 
+# the command line and applies to them all.  Up to --batch-workers collections run at a time, each in its own 
+# thread, so each keeps its own diagnostics and caches (see LocalDict), and each line it prints is prefixed 
+# with its name.  The service account is authenticated ONCE and its client shared, and every Sheets request
+# of every collection draws on one QuotaBudget, a token bucket of --quota requests per minute.  A combined
+# report of each collection's status, rows and timing is printed and saved at the end.
+
+MANIFEST_COLUMNS = ("sheet", "mods_csv", "headings", "output", "target_tab", "cache", "report")
+
+# QuotaBudget: a token bucket shared by every thread, refilled at `per_minute` requests per minute
+class QuotaBudget:
+
+  def __init__( self, per_minute ):
+    self.rate = per_minute / 60.0
+    self.tokens = float(per_minute)
+    self.capacity = float(per_minute)
+    self.updated = time.monotonic( )
+    self.lock = threading.Lock( )
+    self.waited = LocalDict( )    # "seconds" this thread has waited for a token
+
+  # take: take one token, first waiting for it if the budget is spent.  Tokens are reserved in order, so
+  #   waiting threads are served first come, first served.
+  def take( self ):
+    with self.lock:
+      now = time.monotonic( )
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+      self.updated = now
+      wait = -self.tokens / self.rate if self.tokens < 0 else 0
+    if wait:
+      self.waited["seconds"] = self.waited.get("seconds", 0) + wait
+      time.sleep(wait)
+
+# Budgeted: a gspread client, spreadsheet or worksheet whose every method call, each one a Sheets request, 
+#   first takes a token from the budget.  The spreadsheets and worksheets it returns are budgeted too.
+class Budgeted:
+  returns_budgeted = ("open", "open_by_key", "worksheet", "add_worksheet")
+
+  def __init__( self, target, budget ):
+    self.target = target
+    self.budget = budget
+
+  def __getattr__( self, name ):
+    value = getattr(self.target, name)
+    if not callable(value):
+      return value
+    def request( *args, **kwargs ):
+      self.budget.take( )
+      result = value(*args, **kwargs)
+      return Budgeted(result, self.budget) if name in self.returns_budgeted else result
+    return request
+
+# CollectionOutput: sys.stdout during a batch.  Each line a collection prints is prefixed with its name, and
+#   written whole, so the output of collections running side by side doesn't interleave.
+class CollectionOutput:
+
+  def __init__( self, stream ):
+    self.stream = stream
+    self.lock = threading.Lock( )
+    self.local = threading.local( )
+
+  def label( self, name ):
+    self.local.label = name
+    self.local.pending = ""
+
+  def write( self, text ):
+    label = getattr(self.local, 'label', None)
+    if label is None:
+      with self.lock:
+        return self.stream.write(text)
+    lines = (self.local.pending + text).split("\n")
+    self.local.pending = lines.pop( )
+    if lines:
+      with self.lock:
+        self.stream.write("".join("[{}] {}\n".format(label, line) for line in lines))
+    return len(text)
+
+  # finish: write out anything this thread printed without a newline
+  def finish( self ):
+    if getattr(self.local, 'pending', ""):
+      self.write("\n")
+
+  def flush( self ):
+    self.stream.flush( )
+
+# manifest_collections: the options of each collection in the manifest, checked before any of them runs
+def manifest_collections( parser, args ):
+  with open(args.manifest, 'r', newline='') as data:
+    rows = list(csv.DictReader(data))
+  if not rows:
+    parser.error("--manifest {} lists no collections".format(args.manifest))
+
+  batch = []
+  for number, row in enumerate(rows, start=2):
+    unknown = [column for column in row if column not in MANIFEST_COLUMNS]
+    if unknown:
+      parser.error("--manifest {} has unknown column(s) {}, it can have {}".format(args.manifest, ", ".join(map(str, unknown)), ", ".join(MANIFEST_COLUMNS)))
+    if not row.get("sheet") and not row.get("mods_csv"):
+      parser.error("--manifest {} row {} names no `sheet` or `mods_csv`".format(args.manifest, number))
+    collection = argparse.Namespace(**vars(args))
+    collection.sheet = collection.mods_csv = collection.headings = None    # each row names its own source
+    for column, value in row.items():
+      if value:
+        setattr(collection, column, value)
+    collection.name = row.get("sheet") or os.path.splitext(os.path.basename(row.get("output") or row["mods_csv"]))[0]
+    if not row.get("output"):
+      collection.output = "transformed-{}.csv".format(sanitize_pattern.sub('_', collection.name))
+    check_args(parser, collection)
+    batch.append(collection)
+
+  outputs = [collection.output for collection in batch]
+  if len(set(outputs)) < len(outputs):
+    parser.error("--manifest {} gives two collections the same output, give each its own `output`".format(args.manifest))
+  return batch
+
+# run_batch: run every collection in the manifest, --batch-workers at a time, and report on them all.  Exits with
+#   status 1 if any collection isn't "ok".
+def run_batch( parser, args ):
+  import sys
+  import concurrent.futures
+
+  batch = manifest_collections(parser, args)
+  budget = QuotaBudget(max(args.quota, 1))
+  client = None
+  if any(not collection.mods_csv for collection in batch):
+    try:
+      client = Budgeted(service_account( ), budget)
+    except Exception as e:
+      print(e)
+      exit(1)
+
+  output = CollectionOutput(sys.stdout)
+
+  # run_collection: run one collection in this thread, and return its line of the report
+  def run_collection( collection ):
+    output.label(collection.name)
+    result = { "collection": collection.name, "status": "ok" }
+    start = time.perf_counter( )
+    try:
+      result.update(run(collection, client))
+      if result["tab"] and not result["uploaded"]:
+        result["status"] = "failed, upload"
+    except SystemExit as e:
+      result["status"] = "stopped" if e.code in (None, 0) else "failed, exit status {}".format(e.code)
+    except Exception as e:
+      print(e)
+      result["status"] = "error: {}".format(e)
+    result["seconds"] = round(time.perf_counter( ) - start, 3)
+    result["quota_wait_seconds"] = round(budget.waited.get("seconds", 0), 3)
+    budget.waited.clear( )
+    output.finish( )
+    return result
+
+  start = time.perf_counter( )
+  sys.stdout = output
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max(args.batch_workers, 1)) as pool:
+      results = list(pool.map(run_collection, batch))
+  finally:
+    sys.stdout = output.stream
+
+  report = {
+    "date": datetime.now().isoformat(timespec='seconds'),
+    "manifest": args.manifest,
+    "quota_per_minute": args.quota,
+    "seconds": round(time.perf_counter( ) - start, 3),
+    "collections": results,
+  }
+  print("Batch of {} collections in {:.1f}s:".format(len(results), report["seconds"]))
+  print("  {:<32} {:<24} {:>9} {:>6} {:>9} {:>11}".format("collection", "status", "rows", "valid", "seconds", "quota wait"))
+  for result in results:
+    print("  {:<32} {:<24} {:>9} {:>6} {:>9.1f} {:>11.1f}".format(result["collection"], result["status"][:24], result.get("rows", ""),
+      str(result.get("valid", "")), result["seconds"], result["quota_wait_seconds"]))
+  with open(args.batch_report, 'w') as f:
+    json.dump(report, f, indent=2)
+  if any(result["status"] != "ok" for result in results):
+    exit(1)
+
+######################################################################
+
+# Main...
+# build_parser: the command line options
+def build_parser( ):
+  parser = argparse.ArgumentParser(description="Transform exported MODS records into ready-for-CB .csv data.")
+  parser.add_argument('--sheet', default="CB-CSV_DG-01", metavar='NAME', help="the Google Sheet to read from and upload to (default CB-CSV_DG-01)")
+  parser.add_argument('--sheets-standin', metavar='STATE', help="use the offline Google Sheets stand-in, with the spreadsheets in this JSON state file, see sheets_standin.py")
+  parser.add_argument('--mods-csv', help="read MODS records from this local .csv export instead of the 'mods.csv' tab (requires --headings)")
+  parser.add_argument('--headings', help="read CB column headings from row 1 of this local .csv instead of the 'Sheet1' tab")
+  parser.add_argument('--output', default='transformed.csv', metavar='FILE', help="write the transformed rows to FILE, as .csv (the default, transformed.csv), .csv.gz, .ndjson or .parquet")
+  parser.add_argument('--workers', type=int, default=1, metavar='N', help="transform records across N processes (default 1, no pool)")
+  parser.add_argument('--chunk-size', type=int, default=1000, metavar='N', help="records per chunk handed to each worker process (default 1000)")
+  parser.add_argument('--cache', metavar='FILE', help="incremental mode: only re-transform records that are new or changed since the run that built this SQLite cache")
+  parser.add_argument('--target-tab', metavar='TAB', help="update this existing CB tab with only the changes, instead of creating a new datetime-named tab")
+  parser.add_argument('--report', metavar='FILE', help="save the validation report to FILE as JSON")
+  parser.add_argument('--fail-fast', action='store_true', help="stop at the first validation problem, with exit status 2")
+  parser.add_argument('--resume', action='store_true', help="continue an interrupted run from its checkpoint, without transforming or uploading again the rows it finished")
+  parser.add_argument('--checkpoint-rows', type=int, default=10000, metavar='N', help="commit the output and its checkpoint every N rows (default 10000)")
+  parser.add_argument('--check-links', action='store_true', help="send a HEAD request for every object_location, image_thumb and image_small URL, and report the broken ones")
+  parser.add_argument('--link-cache', default='link-cache.db', metavar='FILE', help="the SQLite cache of link statuses for --check-links (default link-cache.db)")
+  parser.add_argument('--link-ttl', type=float, default=7, metavar='DAYS', help="re-check links older than DAYS in the link cache (default 7)")
+  parser.add_argument('--link-concurrency', type=int, default=32, metavar='N', help="check up to N links at a time (default 32)")
+  parser.add_argument('--link-base', metavar='URL', help="check links against this server instead, keeping their paths, e.g. a local stub at http://127.0.0.1:8000")
+  parser.add_argument('--batch-rows', type=int, default=2000, metavar='N', help="rows per Google Sheets upload request (default 2000)")
+  parser.add_argument('--profile', action='store_true', help="time the imports, every transform function and every stage, and print a table at the end (runs with one worker)")
+  parser.add_argument('--profile-out', metavar='FILE', help="also run under cProfile and save the pstats to FILE")
+  parser.add_argument('--verbose', action='store_true', help="print every diagnostic event as it happens, for debugging a mapping")
+  parser.add_argument('--samples', type=int, default=0, metavar='N', help="keep up to N example values per diagnostic in the summary")
+  parser.add_argument('--manifest', metavar='FILE', help="batch mode: run every collection listed in this .csv manifest, see run_batch()")
+  parser.add_argument('--batch-workers', type=int, default=4, metavar='N', help="in batch mode, run up to N collections at a time (default 4)")
+  parser.add_argument('--quota', type=int, default=60, metavar='N', help="in batch mode, share a budget of N Google Sheets requests per minute across all collections (default 60)")
+  parser.add_argument('--batch-report', default='batch-report.json', metavar='FILE', help="in batch mode, save the per-collection status and timing report to FILE (default batch-report.json)")
+  return parser
+
+# check_args: stop with a usage error if the options of a run don't go together
+def check_args( parser, args ):
+  if bool(args.mods_csv) != bool(args.headings):
+    parser.error("--mods-csv and --headings must be used together")
+  if args.resume and args.cache:
+    parser.error("--resume can't be used with --cache, which already skips the records that are unchanged")
+  if output_writer(args.output) is None:
+    parser.error("--output must end in one of {}".format(", ".join(output_formats)))
+  if output_writer(args.output) is ParquetWriter:
+    try:
+      import pyarrow.parquet
+    except ImportError:
+      parser.error("--output {} needs pyarrow, try 'pip3 install pyarrow'".format(args.output))
+
+# main: the command line, `argv` defaults to sys.argv[1:]
+def main( argv=None ):
+  global verbose, max_samples, profiling, standin_state
+
+  parser = build_parser( )
+  args = parser.parse_args(argv)
+  check_args(parser, args)
+  if args.manifest and (args.profile or args.profile_out):
+    parser.error("--profile and --profile-out time a single run, they can't be used with --manifest")
+
+  verbose = args.verbose
+  standin_state = args.sheets_standin
+  max_samples = args.samples
+
+  # Profiling: the report and any pstats are written at exit, however the run ends
+  profiling = args.profile
+  if profiling:
+    atexit.register(report_profile)
+    record_time(("import", ""), import_seconds)
+    if args.workers > 1:
+      print("--profile times the transform in this process, ignoring --workers {}".format(args.workers))
+      args.workers = 1
+  if args.profile_out:
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile( )
+    atexit.register(lambda: (profiler.disable( ), profiler.dump_stats(args.profile_out), pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)))
+    profiler.enable( )
+
+  if args.manifest:
+    run_batch(parser, args)
+  else:
+    run(args)
+  exit( )
+
+# run: one complete run, for one collection, with the given options.  `client` is an authenticated gspread 
+#   client to share, rather than authenticating again.  Returns a summary of the run, or exits early: with status 1
+#   if the run can't start or has nothing to transform, or 2 if validation fails.
+def run( args, client=None ):
+  sheetName = args.sheet
+  old_headings = new_headings = data_records = None
+
+  # Local mode: stream records from the local export, no Google Sheet involved at all
+  if args.mods_csv:
+    sheetName = args.mods_csv
+    old_headings = local_headings(args.mods_csv)
+    new_headings = local_headings(args.headings)
+    data_records = local_mods_records(args.mods_csv)
+    if profiling:
+      data_records = profiled_records(data_records)
+
+  else:
+    # Open the Google service account and sheet.  
+    # See https://docs.gspread.org/en/latest/oauth2.html#for-bots-using-service-account Step 8 for details!
+    with stage("open sheet"):
+      try:
+        sa = client or service_account( )
+      except Exception as e:
+        print(e)
+
+      try:  
+        sh = retry_on_quota(sa.open, sheetName)
+      except Exception as e:
+        print(e)  
+
+    # Read the "mods.csv" headings and data_records[], and the "Sheet1" headings, in one batched request
+    with stage("read"):
+      try:
+        old_headings, data_records, new_headings = sheet_inputs(sh)
+      except Exception as e:
+        print(e)
+
+  # End of the input, check that we have old_headings, new_headings, and data_records
+  if not old_headings:
+    print("Check the {} sheet for valid 'mods.csv' headings, none found?".format(sheetName))
+    exit(1)
+
+  if not data_records:
+    print("Check the {} sheet for valid 'mods.csv' data, no data_records found?".format(sheetName))
+    exit(1)
+
+  if not new_headings:
+    print("Check the {} sheet for valid 'Sheet1' headings, none found?".format(sheetName))
+    exit(1)
+
+  # Compile the "transform" for these headings.  Any old_headings not accounted for, unknown functions, or
+  # targets missing from `Sheet1` are all reported here, before a single record is transformed!
+  try:
+    plan = build_transform_plan(old_headings, new_headings)
+  except ValueError as e:
+    print(e)
+    exit(1)
+
+  if profiling:
+    plan = profile_plan(plan)
+
+  # All clear, transform the records one at a time into the output, `transformed.csv` unless --output says otherwise
+  # per https://community.esri.com/t5/python-questions/how-to-convert-a-google-spreadsheet-to-a-csv-file/td-p/452722
+  nCols = len(new_headings)
+
+  # Checkpoints: a fresh run replaces any old checkpoint, --resume picks up where the last run left off
+  output = args.output
+  checkpoint_file = output + CHECKPOINT_SUFFIX
+  signature = plan_signature(old_headings, new_headings)
+  source = os.path.abspath(args.mods_csv) if args.mods_csv else sheetName
+  checkpoint = None
+  if args.resume:
+    checkpoint = load_checkpoint(checkpoint_file, signature, source, output)
+    if checkpoint is None:
+      print("Starting from the first record")
+  if checkpoint is None:
+    checkpoint = new_checkpoint(signature, source)
+    save_checkpoint(checkpoint_file, checkpoint)
+  elif checkpoint["rows"]:
+    data_records = resume_records(data_records, checkpoint, column_indexes(old_headings).get("PID"))
+    if data_records is None:
+      print("The {} records no longer line up with the checkpoint '{}', run without --resume to start over".format(sheetName, checkpoint_file))
+      exit(1)
+    merge_diagnostics({ tuple(entry[:3]): entry[3:] for entry in checkpoint["diagnostics"] })
+    print("Resuming after row {} ({}) of '{}'".format(checkpoint["rows"], checkpoint["objectid"], output))
+
+  # With workers, commit on chunk boundaries so the diagnostics saved are exactly those of the rows written
+  every = max(args.checkpoint_rows, 1)
+  if args.workers > 1:
+    every = max(every // args.chunk_size, 1) * args.chunk_size
+
+  # In incremental mode only new or changed records are transformed, serially since there are usually few
+  changes = {}
+  if args.cache:
+    if "PID" not in old_headings:
+      print("Check the {} sheet, --cache needs a 'PID' column to key records!".format(sheetName))
+      exit(1)
+    rows = cached_rows(data_records, plan, old_headings, new_headings, args.cache, changes)
+  else:
+    rows = transformed_rows(data_records, plan, old_headings, new_headings, args.workers, args.chunk_size)
+
+  # Validation checks the final rows, so compound parents are checked with the thumbnails they inherit
+  validation = new_validation(new_headings)
+  check = lambda rows: validated_rows(rows, new_headings, validation, args.fail_fast)
+  compounds = None
+
+  try:
+    if args.fail_fast and validation["missing_columns"]:
+      raise ValidationFailed("'Sheet1' has no {} column".format(", ".join(validation["missing_columns"])))
+    if checkpoint["written"]:
+      nRows = checkpoint["rows"] + 1
+    else:
+      with stage("transform + write"):
+        nRows = write_transformed(rows, new_headings, output, checkpoint, checkpoint_file, every)
+
+    # Resolve compound objects, now that every objectid is known, validating each row as it is rewritten.
+    #   Output that is already resolved, or has nothing to resolve, is validated as it stands.
+    if not checkpoint["resolved"]:
+      with stage("resolve parents"):
+        compounds = resolve_parents(output, check)
+      save_checkpoint(checkpoint_file, checkpoint, resolved=True)
+    if compounds is None:
+      with stage("validate"):
+        for row in check(written_rows(output, nRows - 1)):
+          pass
+  except ValidationFailed as e:
+    print("Validation failed: {}".format(e))
+    nRows = None
+
+  # Check that every object and thumbnail link in the output answers
+  if nRows is not None and args.check_links:
+    links = {}
+    with stage("check links"):
+      validation["broken_links"] = check_output_links(output, args.link_cache, args.link_ttl * 86400, max(args.link_concurrency, 1), links, base=args.link_base)
+    print("Link check: {links} links, {cached} from the link cache, {checked} checked, ".format(**links) + "{} broken".format(validation["broken_links"]["count"]))
+
+  report_diagnostics( )
+  report_caches( )
+  finish_validation(validation, plan)
+  report_validation(validation)
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(validation, f, indent=2)
+  if nRows is None:
+    exit(2)
+
+  if changes:
+    print("Incremental transform: {added} added, {changed} changed, {removed} removed, {unchanged} unchanged".format(**changes))
+
+  if nRows == 1:
+    print("Check the {} sheet for valid 'mods.csv' data, no data_records found?".format(sheetName))
+    exit(1)
+
+  summary = { "rows": nRows - 1, "valid": validation["valid"], "output": output, "tab": None, "uploaded": False }
+
+  if compounds:
+    print("Compound objects: {children} children of {parents} parents resolved, {inherited} parents inherited a thumbnail, {unresolved} parentids outside this collection cleared".format(**compounds))
+
+  # Local mode is done, the output is the result
+  if args.mods_csv:
+    os.remove(checkpoint_file)
+    print("Wrote {} rows to '{}'".format(nRows, output))
+    return summary
+
+  # Bring an existing CB tab up to date with just the changes
+  if args.target_tab:
+    summary["tab"] = args.target_tab
+    with stage("upload"):
+      try:
+        upload_delta(output, sh, args.target_tab, nRows, nCols, args.batch_rows)
+        os.remove(checkpoint_file)
+        summary["uploaded"] = True
+      except Exception as e:
+        print(e)
+    return summary
+
+  # Write the temporary transformed output to a new tab in our Google Sheet
+  # Make a datestamp to name the new worksheet, unless we are resuming an upload to one
+  new_tab = checkpoint["tab"] or datetime.now().strftime("%Y-%b-%d-%I:%M%p")
+  summary["tab"] = new_tab
+
+  with stage("upload"):
+    # Create the new/empty worksheet
+    if not checkpoint["tab"]:
+      try:
+        worksheet = retry_on_quota(sh.add_worksheet, title=new_tab, rows=nRows, cols=nCols)
+        save_checkpoint(checkpoint_file, checkpoint, tab=new_tab)
+      except Exception as e:
+        print(e)  
+
+    # Call our function to write the new Google Sheet worksheet, after any rows already uploaded
+    try:
+      paste_csv(output, sh, new_tab, args.batch_rows, skip_rows=checkpoint["uploaded"],
+        progress=lambda uploaded: save_checkpoint(checkpoint_file, checkpoint, uploaded=uploaded))
+      os.remove(checkpoint_file)
+      summary["uploaded"] = True
+    except Exception as e:
+      print(e)
+
+  # Delete the temp file
+  # os.remove(output)    # Keep the file during script development and testing
+
+  return summary